@@ -1,17 +1,32 @@
 import streamlit as st
-from openrouter_app.chat import chat_stream
-from openrouter_app.semantic_search import build_vector_store_from_folder, semantic_search_local
-from openrouter_app.rag import answer_with_context_stream
-from openrouter_app.optimized_rag import OptimizedRAG
-from openrouter_app.prompt_cache import PromptCache
 from openrouter_app.openrouter_client import test_openrouter_connection
 from openrouter_app.openrouter_models import list_openrouter_models
 import os
-import html
 import base64
+import hashlib
+import shutil
 
 os.makedirs("./temp_docs", exist_ok=True)
 
+# ----------------------------
+# Cached API lookups (avoid per-rerun HTTP round-trips)
+# ----------------------------
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_openrouter_models():
+    return list_openrouter_models()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_connection_ok() -> bool:
+    return test_openrouter_connection()
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_chat_models_by_name():
+    chat_models, _ = cached_openrouter_models()
+    return {m["name"]: m for m in chat_models}
+
+
 # ----------------------------
 # Startup checks
 # ----------------------------
@@ -19,7 +34,7 @@ if not os.getenv("OPENROUTER_API_KEY"):
     st.error("⚠️ OPENROUTER_API_KEY environment variable not set. Please configure it before using the app.")
     st.stop()
 
-if not test_openrouter_connection():
+if not cached_connection_ok():
     st.warning(
         "⚠️ Could not connect to OpenRouter API. Please check your API key and ensure your account has credits at https://openrouter.ai/settings/credits"
     )
@@ -30,11 +45,16 @@ if not test_openrouter_connection():
 # ----------------------------
 @st.cache_resource
 def get_optimized_rag():
+    # Imported lazily so conversational-only sessions skip the RAG stack
+    from openrouter_app.optimized_rag import OptimizedRAG
+
     return OptimizedRAG()
 
 
 @st.cache_resource
 def get_prompt_cache():
+    from openrouter_app.prompt_cache import PromptCache
+
     return PromptCache()
 
 
@@ -44,10 +64,16 @@ st.set_page_config(page_title="SDQA Assistant", layout="wide")
 # ----------------------------
 # UI Styling (CSS)
 # ----------------------------
-def load_css(file_path: str):
+@st.cache_data(show_spinner=False)
+def _css_block(file_path: str) -> str:
     with open(file_path, "r") as f:
-        css_content = f.read()
-    st.markdown(f"<style>{css_content}</style>", unsafe_allow_html=True)
+        return f"<style>{f.read()}</style>"
+
+
+def load_css(file_path: str):
+    # The markdown call itself must run per rerun (elements do not persist),
+    # but the file read and <style> wrapping are cached.
+    st.markdown(_css_block(file_path), unsafe_allow_html=True)
 
 load_css("css/styles.css")
 
@@ -55,6 +81,7 @@ load_css("css/styles.css")
 # Top header (logo + title)
 # ----------------------------
 
+@st.cache_data(show_spinner=False)
 def img_to_base64(path: str) -> str | None:
     try:
         with open(path, "rb") as f:
@@ -66,9 +93,19 @@ def img_to_base64(path: str) -> str | None:
 # Message rendering helpers
 # ----------------------------
 
+# Single-pass HTML escape + newline conversion for user bubbles
+_BUBBLE_TRANS = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&#x27;",
+    "\n": "<br>",
+})
+
+
 def bubble_html(content: str) -> str:
-    safe = html.escape(content).replace("\n", "<br>")
-    return f'<div class="user-bubble">{safe}</div>'
+    return f'<div class="user-bubble">{content.translate(_BUBBLE_TRANS)}</div>'
 
 
 def render_message(role: str, content: str, placeholder=None):
@@ -79,6 +116,37 @@ def render_message(role: str, content: str, placeholder=None):
         target.markdown(content)
 
 
+def tokens_only(stream):
+    """Adapt a (token, stats) generator into a plain token stream for st.write_stream."""
+    for token, _stats in stream:
+        yield token
+
+
+USER_AVATAR = "assets/user-4254_1024.png"
+ASSISTANT_AVATAR = "https://help.vodacom.co.za/static/media/tobi-chat.8fcbfe07.svg"
+
+
+def stream_assistant(container, stream, with_stats=False):
+    """Stream an assistant reply into a chat message and return the full text."""
+    if with_stats:
+        stream = tokens_only(stream)
+    with container.chat_message("assistant", avatar=ASSISTANT_AVATAR):
+        return st.write_stream(stream)
+
+
+def append_user_message(container, history, placeholders, content):
+    """Record a user turn in history and render it; single point for all branches.
+
+    The rendered placeholder is appended to the passed-in list (the one
+    render_history returned) so the helper has no hidden module state.
+    """
+    history.append({"role": "user", "content": content})
+    with container.chat_message("user", avatar=USER_AVATAR):
+        cp = st.empty()
+        render_message("user", content, placeholder=cp)
+        placeholders.append(cp)
+
+
 # ----------------------------
 # Sidebar
 # ----------------------------
@@ -92,18 +160,12 @@ mode = st.sidebar.radio(
     ["Conversational Mode or RAG", "Intelligent Document Querying Mode (RAG)"],
 )
 
-chat_models, embedding_models = list_openrouter_models()
+chat_models, embedding_models = cached_openrouter_models()
 
-selected_chat_name = "Meta Llama 3.3 70B"
-selected_chat_model = chat_models[0]
-for chat_model in chat_models:
-    if chat_model.get("name") == selected_chat_name:
-        selected_chat_model = chat_model
-        break
+chat_models_by_name = cached_chat_models_by_name()
 
-chat_model_names = [m["name"] for m in chat_models]
-selected_chat_name = st.sidebar.selectbox("Choose AI Model", chat_model_names, index=0)
-selected_chat_model = next(m for m in chat_models if m["name"] == selected_chat_name)
+selected_chat_name = st.sidebar.selectbox("Choose AI Model", list(chat_models_by_name), index=0)
+selected_chat_model = chat_models_by_name.get(selected_chat_name, chat_models[0])
 
 st.sidebar.markdown("### Model Behavior Settings")
 temperature = st.sidebar.slider("Temperature", min_value=0.0, max_value=1.0, value=0.7, step=0.05)
@@ -154,16 +216,28 @@ if "mode_histories" not in st.session_state:
 chat_container = st.container()
 
 
+# Only the most recent messages get full chat-message widgets; older ones are
+# collapsed into one static markdown block so rerun cost stays O(1 + K).
+VISIBLE_MESSAGES = 20
+
+
 def render_history(container, history):
     placeholders = []
-    for msg in history:
-        ph = container.empty()
-        with ph.container():
-            avatar = "assets/user-4254_1024.png" if msg["role"] == "user" else "https://help.vodacom.co.za/static/media/tobi-chat.8fcbfe07.svg"
-            with st.chat_message(msg["role"], avatar=avatar):
-                cp = st.empty()
-                render_message(msg["role"], msg["content"], placeholder=cp)
-                placeholders.append(cp)
+
+    frozen = history[:-VISIBLE_MESSAGES]
+    if frozen:
+        blob = "\n\n".join(
+            f"**{'You' if m['role'] == 'user' else 'Assistant'}:** {m['content']}"
+            for m in frozen
+        )
+        container.markdown(blob)
+
+    for msg in history[-VISIBLE_MESSAGES:]:
+        avatar = USER_AVATAR if msg["role"] == "user" else ASSISTANT_AVATAR
+        with container.chat_message(msg["role"], avatar=avatar):
+            cp = st.empty()
+            render_message(msg["role"], msg["content"], placeholder=cp)
+            placeholders.append(cp)
     return placeholders
 
 
@@ -175,11 +249,19 @@ uploaded_file = None
 if mode == "Conversational Mode or RAG":
     uploaded_file = st.sidebar.file_uploader("Drop Your File Here", type=["pdf", "txt", "docx", "png", "jpg", "jpeg", "gif", "bmp", "webp"])
     if uploaded_file:
-        temp_path = f"./temp_docs/{uploaded_file.name}"
-        with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        embed_model = embedding_models[1]
-        st.session_state.temp_vector_store = build_vector_store_from_folder("./temp_docs", embed_model["id"])
+        # Only rebuild the vector store when the uploaded content actually changes;
+        # file_uploader returns the same file on every rerun.
+        file_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+        if st.session_state.get("temp_vs_hash") != file_hash:
+            temp_path = f"./temp_docs/{uploaded_file.name}"
+            uploaded_file.seek(0)
+            with open(temp_path, "wb") as f:
+                shutil.copyfileobj(uploaded_file, f, length=1024 * 1024)
+            from openrouter_app.semantic_search import build_vector_store_from_folder
+
+            embed_model = embedding_models[1]
+            st.session_state.temp_vector_store = build_vector_store_from_folder("./temp_docs", embed_model["id"])
+            st.session_state.temp_vs_hash = file_hash
 
 if user_input:
     current_history = st.session_state.mode_histories[mode]
@@ -187,18 +269,30 @@ if user_input:
 
     if mode == "Conversational Mode or RAG":
         if uploaded_file:
+            from openrouter_app.rag import answer_with_context_stream
+            from openrouter_app.semantic_search import semantic_search_local
+
             embed_model = embedding_models[1]
-            results = semantic_search_local(user_input, embed_model["id"], st.session_state.temp_vector_store)
+
+            # Skip the embed + search round-trip when the user re-sends the
+            # same question against the same uploaded document
+            search_key = (user_input.strip().lower(), st.session_state.get("temp_vs_hash"))
+            if st.session_state.get("last_search_key") == search_key:
+                results = st.session_state.last_search_results
+            else:
+                results = semantic_search_local(user_input, embed_model["id"], st.session_state.temp_vector_store)
+                st.session_state.last_search_key = search_key
+                st.session_state.last_search_results = results
             if results:
-                context = "\n\n".join([r[2] for r in results])
+                # Reuse the joined context for repeat retrievals of the same chunks
+                chunk_ids = tuple(sorted(r[0] for r in results))
+                context_cache = st.session_state.setdefault("context_cache", {})
+                context = context_cache.get(chunk_ids)
+                if context is None:
+                    context = "\n\n".join([r[2] for r in results])
+                    context_cache[chunk_ids] = context
 
-                current_history.append({"role": "user", "content": user_input})
-                ph = chat_container.empty()
-                with ph.container():
-                    with st.chat_message("user", avatar="assets/user-4254_1024.png"):
-                        cp = st.empty()
-                        render_message("user", user_input, placeholder=cp)
-                        placeholders.append(cp)
+                append_user_message(chat_container, current_history, placeholders, user_input)
 
                 response_stream = answer_with_context_stream(
                     selected_chat_model["id"],
@@ -207,34 +301,18 @@ if user_input:
                     message_history=temp_history,
                     temperature=temperature,
                     top_p=top_p,
-                    character_stream=True,
                 )
 
-                ph = chat_container.empty()
-                with ph.container():
-                    with st.chat_message("assistant", avatar="https://help.vodacom.co.za/static/media/tobi-chat.8fcbfe07.svg"):
-                        assistant_cp = st.empty()
-                        placeholders.append(assistant_cp)
-                        full_response = ""
-                        with st.spinner(""):
-                            for token in response_stream:
-                                full_response += token
-                                render_message("assistant", full_response, placeholder=assistant_cp)
-
-                response = full_response
+                response = stream_assistant(chat_container, response_stream)
                 current_history.append({"role": "assistant", "content": response})
             else:
                 st.info("No relevant documents found.")
         else:
+            from openrouter_app.chat import chat_stream
+
             selected_model_id = selected_chat_model["id"]
 
-            current_history.append({"role": "user", "content": user_input})
-            ph = chat_container.empty()
-            with ph.container():
-                with st.chat_message("user", avatar="assets/user-4254_1024.png"):
-                    cp = st.empty()
-                    render_message("user", user_input, placeholder=cp)
-                    placeholders.append(cp)
+            append_user_message(chat_container, current_history, placeholders, user_input)
 
             response_stream = chat_stream(
                 selected_model_id,
@@ -242,34 +320,15 @@ if user_input:
                 message_history=temp_history,
                 temperature=temperature,
                 top_p=top_p,
-                character_stream=True,
             )
 
-            ph = chat_container.empty()
-            with ph.container():
-                with st.chat_message("assistant", avatar="https://help.vodacom.co.za/static/media/tobi-chat.8fcbfe07.svg"):
-                    assistant_cp = st.empty()
-                    placeholders.append(assistant_cp)
-                    full_response = ""
-                    with st.spinner(""):
-                        for token in response_stream:
-                            full_response += token
-                            render_message("assistant", full_response, placeholder=assistant_cp)
-
-            response = full_response
+            response = stream_assistant(chat_container, response_stream)
             current_history.append({"role": "assistant", "content": response})
 
     else:
         embed_model = embedding_models[1]
-        optimized_rag = get_optimized_rag()
 
-        current_history.append({"role": "user", "content": user_input})
-        ph = chat_container.empty()
-        with ph.container():
-            with st.chat_message("user", avatar="assets/user-4254_1024.png"):
-                cp = st.empty()
-                render_message("user", user_input, placeholder=cp)
-                placeholders.append(cp)
+        append_user_message(chat_container, current_history, placeholders, user_input)
 
         response_stream = optimized_rag.answer_with_optimization_stream(
             model_id=selected_chat_model["id"],
@@ -283,16 +342,5 @@ if user_input:
             retrieve_past_contexts=True,
         )
 
-        ph = chat_container.empty()
-        with ph.container():
-            with st.chat_message("assistant", avatar="https://help.vodacom.co.za/static/media/tobi-chat.8fcbfe07.svg"):
-                assistant_cp = st.empty()
-                placeholders.append(assistant_cp)
-                full_response = ""
-                with st.spinner(""):
-                    for token, _stats in response_stream:
-                        full_response += token
-                        render_message("assistant", full_response, placeholder=assistant_cp)
-
-        response = full_response
+        response = stream_assistant(chat_container, response_stream, with_stats=True)
         current_history.append({"role": "assistant", "content": response})
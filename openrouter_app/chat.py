@@ -1,51 +1,66 @@
-import json
 import requests
 from .openrouter_client import get_openrouter_client
 from .model_fallback import get_fallback_manager
 
+try:
+    # Optional: orjson reads and writes JSON several times faster than the
+    # stdlib, which matters on the per-token SSE path
+    from orjson import loads as _json_loads, dumps as _json_dumps
+except ImportError:
+    import json as _json
+
+    _json_loads = _json.loads
+
+    def _json_dumps(obj):
+        return _json.dumps(obj, separators=(",", ":")).encode()
+
+# Payload fields that never change per request
+_STREAM_PAYLOAD_STATIC = {"max_tokens": 2000, "stream": True}
+_CHAT_PAYLOAD_STATIC = {"max_tokens": 2000}
+
 
 class RateLimitError(Exception):
     """Exception raised when a model is rate limited"""
     pass
 
 
-def invoke_model_stream(model_id, messages, temperature=0.7, top_p=0.9, character_stream=True):
+def _clamp(value, lo, hi):
+    """Clamp value into [lo, hi]; the conditional skips two builtin calls"""
+    return lo if value < lo else hi if value > hi else value
+
+
+def invoke_model_stream(model_id, messages, temperature=0.7, top_p=0.9):
     """
     Stream response tokens from OpenRouter model using OpenAI-compatible API.
 
-    Yields text tokens one by one for real-time display.
+    Yields each SSE delta as-is; re-chunking deltas only multiplied the
+    number of generator resumes between here and the UI.
 
     Args:
         model_id: OpenRouter model ID (e.g., "openai/gpt-4o")
         messages: List of message dicts with 'role' and 'content'
         temperature: Sampling temperature (0.0-2.0)
         top_p: Nucleus sampling parameter (0.0-1.0)
-        character_stream: If True, break larger chunks into character-level streams
 
     Yields:
-        Text tokens (chars or words) from the model response
+        Text deltas from the model response
     """
     try:
         client = get_openrouter_client()
-        headers = {
-            "Authorization": f"Bearer {client['api_key']}",
-            "HTTP-Referer": "http://localhost:8501",  # Streamlit default
-            "Content-Type": "application/json"
-        }
 
         payload = {
             "model": model_id,
             "messages": messages,
-            "temperature": min(max(temperature, 0.0), 2.0),  # Clamp to valid range
-            "top_p": min(max(top_p, 0.0), 1.0),  # Clamp to valid range
-            "max_tokens": 2000,
-            "stream": True
+            "temperature": _clamp(temperature, 0.0, 2.0),
+            "top_p": _clamp(top_p, 0.0, 1.0),
+            **_STREAM_PAYLOAD_STATIC
         }
 
+        # Pre-serialized body skips requests' internal stdlib json path;
+        # auth/content-type headers are pre-set on the shared session
         response = client["session"].post(
             f"{client['base_url']}/chat/completions",
-            json=payload,
-            headers=headers,
+            data=_json_dumps(payload),
             stream=True,
             timeout=60
         )
@@ -63,41 +78,40 @@ def invoke_model_stream(model_id, messages, temperature=0.7, top_p=0.9, characte
                 yield f"Error: {response.status_code} - {error_msg}"
             return
 
-        # Parse SSE stream (OpenAI format)
-        for line in response.iter_lines():
-            if not line:
-                continue
-
-            line_str = line.decode('utf-8') if isinstance(line, bytes) else line
-
-            if line_str.startswith("data: "):
-                data_str = line_str[6:]  # Remove "data: " prefix
+        # Parse the SSE stream (OpenAI format) at the byte level: scan a
+        # reusable buffer for line boundaries instead of paying iter_lines'
+        # per-line str decode and allocation; the payload bytes go straight
+        # into the JSON parser
+        buf = bytearray()
+        for chunk_bytes in response.iter_content(chunk_size=8192):
+            buf += chunk_bytes
+            while (newline := buf.find(b"\n")) != -1:
+                line = bytes(buf[:newline]).rstrip(b"\r")
+                del buf[:newline + 1]
+
+                if not line.startswith(b"data: "):
+                    continue
+                data_bytes = line[6:]  # Remove "data: " prefix
 
-                if data_str == "[DONE]":
-                    break
+                if data_bytes == b"[DONE]":
+                    return
 
                 try:
-                    chunk = json.loads(data_str)
-                    # Extract token from OpenAI format
-                    if "choices" in chunk and len(chunk["choices"]) > 0:
-                        delta = chunk["choices"][0].get("delta", {})
-                        if "content" in delta:
-                            text = delta["content"]
-                            # Stream character by character for smoother UI
-                            if character_stream:
-                                for char in text:
-                                    yield char
-                            else:
-                                yield text
-                except json.JSONDecodeError:
+                    chunk = _json_loads(data_bytes)
+                except ValueError:
                     continue
+                # Extract token from OpenAI format
+                if "choices" in chunk and len(chunk["choices"]) > 0:
+                    delta = chunk["choices"][0].get("delta", {})
+                    if "content" in delta:
+                        yield delta["content"]
 
     except Exception as e:
         print(f"Error streaming from model: {e}")
         yield f"Error: {str(e)}"
 
 
-def invoke_model_with_fallback(model_id, messages, temperature=0.7, top_p=0.9, character_stream=True):
+def invoke_model_with_fallback(model_id, messages, temperature=0.7, top_p=0.9):
     """
     Stream response with automatic fallback to other models on rate limit.
     
@@ -106,10 +120,9 @@ def invoke_model_with_fallback(model_id, messages, temperature=0.7, top_p=0.9, c
         messages: List of message dicts with 'role' and 'content'
         temperature: Sampling temperature (0.0-2.0)
         top_p: Nucleus sampling parameter (0.0-1.0)
-        character_stream: If True, break larger chunks into character-level streams
     
     Yields:
-        Text tokens from the model response
+        Text deltas from the model response
     """
     fallback_manager = get_fallback_manager()
     
@@ -132,7 +145,7 @@ def invoke_model_with_fallback(model_id, messages, temperature=0.7, top_p=0.9, c
             print(f"[ATTEMPT {retry_count + 1}] Using model: {current_model['name']}")
             
             # Try to stream with current model
-            for token in invoke_model_stream(current_model_id, messages, temperature, top_p, character_stream):
+            for token in invoke_model_stream(current_model_id, messages, temperature, top_p):
                 yield token
             
             # Success! Exit
@@ -165,7 +178,8 @@ def invoke_model_with_fallback(model_id, messages, temperature=0.7, top_p=0.9, c
     yield "\n\n[ERROR] All fallback attempts exhausted."
 
 
-def chat_with_openrouter(model_id, user_message, message_history=None, temperature=0.7, top_p=0.9):
+def chat_with_openrouter(model_id, user_message=None, message_history=None, temperature=0.7,
+                         top_p=0.9, messages=None):
     """
     Send a message to OpenRouter and get a response (non-streaming).
 
@@ -175,36 +189,36 @@ def chat_with_openrouter(model_id, user_message, message_history=None, temperatu
         message_history: Optional list of prior messages (role/content dicts)
         temperature: Sampling temperature
         top_p: Nucleus sampling parameter
+        messages: Optional fully built message list, sent as-is; callers
+            that already assembled one skip the rebuild/copy below
 
     Returns:
         Response text from the model
     """
     try:
-        if message_history is None:
-            message_history = []
-
         client = get_openrouter_client()
 
-        messages = message_history + [{"role": "user", "content": user_message}]
-
-        headers = {
-            "Authorization": f"Bearer {client['api_key']}",
-            "HTTP-Referer": "http://localhost:8501",
-            "Content-Type": "application/json"
-        }
+        if messages is None:
+            if message_history is None:
+                message_history = []
+            # message_history is treated as read-only; only copy when a new
+            # user message actually has to be appended
+            if user_message:
+                messages = message_history + [{"role": "user", "content": user_message}]
+            else:
+                messages = message_history
 
         payload = {
             "model": model_id,
             "messages": messages,
-            "temperature": min(max(temperature, 0.0), 2.0),
-            "top_p": min(max(top_p, 0.0), 1.0),
-            "max_tokens": 2000
+            "temperature": _clamp(temperature, 0.0, 2.0),
+            "top_p": _clamp(top_p, 0.0, 1.0),
+            **_CHAT_PAYLOAD_STATIC
         }
 
         response = client["session"].post(
             f"{client['base_url']}/chat/completions",
-            json=payload,
-            headers=headers,
+            data=_json_dumps(payload),
             timeout=60
         )
 
@@ -218,7 +232,7 @@ def chat_with_openrouter(model_id, user_message, message_history=None, temperatu
             else:
                 return f"Error: {response.status_code} - {response.text}"
 
-        response_data = response.json()
+        response_data = _json_loads(response.content)
 
         if "choices" in response_data and len(response_data["choices"]) > 0:
             return response_data["choices"][0]["message"]["content"]
@@ -230,11 +244,9 @@ def chat_with_openrouter(model_id, user_message, message_history=None, temperatu
         return f"Error: {str(e)}"
 
 
-def chat_stream(model_id, user_message, message_history=None, temperature=0.7, top_p=0.9, character_stream=True):
+def chat_stream(model_id, user_message, message_history=None, temperature=0.7, top_p=0.9):
     """
-    Stream a conversational response from OpenRouter token-by-token.
-
-    Yields text pieces (chars or small chunks) for real-time UI updates.
+    Stream a conversational response from OpenRouter delta-by-delta.
 
     Args:
         model_id: OpenRouter model id
@@ -242,10 +254,9 @@ def chat_stream(model_id, user_message, message_history=None, temperature=0.7, t
         message_history: Optional list of prior messages (role/content dicts)
         temperature: Sampling temperature
         top_p: Nucleus sampling parameter
-        character_stream: If True, yield character-level pieces for smoother UI
 
     Yields:
-        str tokens from the model streaming endpoint
+        str deltas from the model streaming endpoint
     """
     try:
         if message_history is None:
@@ -254,7 +265,7 @@ def chat_stream(model_id, user_message, message_history=None, temperature=0.7, t
         messages = message_history + [{"role": "user", "content": user_message}]
 
         # Use fallback-enabled streaming helper
-        for chunk in invoke_model_with_fallback(model_id, messages, temperature, top_p, character_stream):
+        for chunk in invoke_model_with_fallback(model_id, messages, temperature, top_p):
             yield chunk
 
     except Exception as e:
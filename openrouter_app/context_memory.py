@@ -2,7 +2,10 @@
 Memory Layer - Context Memory and Storage System
 Stores and retrieves previously processed contexts for intelligent reuse
 """
+import atexit
 import json
+import re
+import threading
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -33,11 +36,29 @@ class ContextMemoryStore:
     def __init__(self, db_path: str = "./.memory_store/contexts.db"):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(exist_ok=True)
+        # Single shared connection: opening one per call paid connection
+        # setup and page-cache warmup on every small query
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._lock = threading.RLock()
+        atexit.register(self._conn.close)
+        # In-process cache of stored query embeddings (per dimension),
+        # invalidated by bumping the version counter on writes
+        self._emb_cache = {}
+        self._emb_version = 0
+        self._configure_connection()
         self._init_db()
-    
+
+    def _configure_connection(self):
+        """Apply performance PRAGMAs once on the shared connection"""
+        cursor = self._conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-65536')
+
     def _init_db(self):
         """Initialize SQLite database for memory storage"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
         
         # Main context memory table
@@ -56,9 +77,17 @@ class ContextMemoryStore:
                 access_count INTEGER DEFAULT 1,
                 confidence_score REAL DEFAULT 0.0,
                 model_id TEXT,
+                embedding BLOB,
+                embed_dim INTEGER,
                 UNIQUE(query_hash, context_hash)
             )
         ''')
+        # Older databases predate the embedding columns
+        for column in ('embedding BLOB', 'embed_dim INTEGER'):
+            try:
+                cursor.execute(f'ALTER TABLE context_memory ADD COLUMN {column}')
+            except sqlite3.OperationalError:
+                pass
         
         # Conversation thread table
         cursor.execute('''
@@ -66,13 +95,24 @@ class ContextMemoryStore:
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 thread_id TEXT UNIQUE NOT NULL,
                 title TEXT,
-                context_ids TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 summary TEXT
             )
         ''')
         
+        # Normalized thread membership: appending a context is one insert
+        # instead of a read-modify-write cycle over a JSON array column
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS thread_contexts (
+                thread_id TEXT NOT NULL,
+                context_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (thread_id, context_id),
+                FOREIGN KEY(context_id) REFERENCES context_memory(id)
+            )
+        ''')
+
         # Related contexts table for fast retrieval
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS context_relations (
@@ -86,22 +126,96 @@ class ContextMemoryStore:
             )
         ''')
         
+        # Normalized tag table so tag lookups hit an index instead of
+        # LIKE substring scans over the JSON tags column
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS context_tags (
+                context_id INTEGER NOT NULL,
+                tag TEXT NOT NULL,
+                PRIMARY KEY (context_id, tag),
+                FOREIGN KEY(context_id) REFERENCES context_memory(id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_context_tags_tag ON context_tags(tag)')
+
+        # One-time backfill from the legacy JSON tags column so contexts
+        # stored before this table existed stay reachable by tag
+        cursor.execute('SELECT EXISTS(SELECT 1 FROM context_tags)')
+        if not cursor.fetchone()[0]:
+            cursor.execute('SELECT id, tags FROM context_memory WHERE tags IS NOT NULL')
+            tag_rows = [
+                (context_id, tag)
+                for context_id, tags_json in cursor.fetchall()
+                for tag in json.loads(tags_json)
+            ]
+            if tag_rows:
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO context_tags (context_id, tag)
+                    VALUES (?, ?)
+                ''', tag_rows)
+
+        # Full-text index over stored queries/contexts so the similarity
+        # fallback can rank by BM25 instead of recency; FTS5 can be compiled
+        # out of some SQLite builds, so degrade gracefully
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS context_fts USING fts5(
+                    query, context,
+                    content='context_memory', content_rowid='id',
+                    tokenize='porter unicode61'
+                )
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS context_memory_fts_ai
+                AFTER INSERT ON context_memory BEGIN
+                    INSERT INTO context_fts(rowid, query, context)
+                    VALUES (new.id, new.query, new.context);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS context_memory_fts_ad
+                AFTER DELETE ON context_memory BEGIN
+                    INSERT INTO context_fts(context_fts, rowid, query, context)
+                    VALUES ('delete', old.id, old.query, old.context);
+                END
+            ''')
+            # The triggers only cover rows written after the virtual table
+            # exists; index pre-existing memories once when it is empty
+            cursor.execute('''
+                SELECT NOT EXISTS(SELECT 1 FROM context_fts)
+                   AND EXISTS(SELECT 1 FROM context_memory)
+            ''')
+            if cursor.fetchone()[0]:
+                cursor.execute("INSERT INTO context_fts(context_fts) VALUES('rebuild')")
+            self._fts_enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"[WARN] FTS5 unavailable, similarity fallback uses recency: {e}")
+            self._fts_enabled = False
+
         # Indexes for performance
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_query_hash ON context_memory(query_hash)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_tags ON context_memory(tags)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_created_at ON context_memory(created_at)')
+        # Composite index so cleanup_old_contexts deletes via a direct
+        # range scan instead of filtering access_count row by row
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_created_access ON context_memory(created_at, access_count)')
         
         conn.commit()
-        conn.close()
     
     @staticmethod
     def _hash_text(text: str) -> str:
-        """Generate hash of text"""
-        return hashlib.sha256(text.encode()).hexdigest()
+        """Generate hash of text
+
+        BLAKE2b is considerably faster than software SHA-256 on the
+        multi-KB queries/contexts hashed on every store and retrieve;
+        digest_size=32 keeps the same 64-char hex width as before.
+        """
+        return hashlib.blake2b(text.encode(), digest_size=32).hexdigest()
     
-    def store_context(self, query: str, context: str, response: str, 
-                     metadata: Dict = None, tags: List[str] = None, 
-                     confidence_score: float = 0.0, model_id: str = None) -> int:
+    def store_context(self, query: str, context: str, response: str,
+                     metadata: Dict = None, tags: List[str] = None,
+                     confidence_score: float = 0.0, model_id: str = None,
+                     embedding: List[float] = None) -> int:
         """
         Store a processed context in memory
         Args:
@@ -112,79 +226,98 @@ class ContextMemoryStore:
             tags: Topic tags for categorization
             confidence_score: Confidence in response (0.0-1.0)
             model_id: Model used to generate response
+            embedding: Query embedding vector for similarity retrieval
         Returns:
             ID of stored context
         """
         query_hash = self._hash_text(query)
         context_hash = self._hash_text(context)
-        metadata_json = json.dumps(metadata) if metadata else None
-        tags_json = json.dumps(tags) if tags else None
-        
-        conn = sqlite3.connect(self.db_path)
+        metadata_json = json.dumps(metadata, separators=(",", ":")) if metadata else None
+        tags_json = json.dumps(tags, separators=(",", ":")) if tags else None
+
+        embedding_blob = None
+        embed_dim = None
+        if embedding is not None and len(embedding) > 0:
+            # Normalized float32 at store time so retrieval scoring is a
+            # single matrix-vector product
+            import numpy as np
+            vec = np.asarray(embedding, dtype=np.float32)
+            norm = float(np.linalg.norm(vec))
+            if norm > 0:
+                embedding_blob = (vec / norm).tobytes()
+                embed_dim = vec.shape[0]
+
+        conn = self._conn
         cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO context_memory 
-                (query_hash, query, context_hash, context, response, metadata, tags, 
-                 confidence_score, model_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (query_hash, query, context_hash, context, response, metadata_json, 
-                  tags_json, confidence_score, model_id))
-            conn.commit()
-            context_id = cursor.lastrowid
-            conn.close()
-            return context_id
-        except sqlite3.IntegrityError:
-            # Update existing entry
-            cursor.execute('''
-                UPDATE context_memory 
-                SET access_count = access_count + 1, 
-                    last_accessed = CURRENT_TIMESTAMP
-                WHERE query_hash = ? AND context_hash = ?
-            ''', (query_hash, context_hash))
-            conn.commit()
-            cursor.execute('''
-                SELECT id FROM context_memory 
-                WHERE query_hash = ? AND context_hash = ?
-            ''', (query_hash, context_hash))
-            context_id = cursor.fetchone()[0]
-            conn.close()
-            return context_id
-        except Exception as e:
-            print(f"Error storing context: {e}")
-            conn.close()
-            return -1
+
+        with self._lock:
+            try:
+                # Upsert + RETURNING collapses the old insert / update-on-
+                # conflict / re-select triple into one statement and one commit
+                cursor.execute('''
+                    INSERT INTO context_memory
+                    (query_hash, query, context_hash, context, response, metadata, tags,
+                     confidence_score, model_id, embedding, embed_dim)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(query_hash, context_hash) DO UPDATE SET
+                        access_count = access_count + 1,
+                        last_accessed = CURRENT_TIMESTAMP
+                    RETURNING id
+                ''', (query_hash, query, context_hash, context, response, metadata_json,
+                      tags_json, confidence_score, model_id, embedding_blob, embed_dim))
+                context_id = cursor.fetchone()[0]
+                if tags:
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO context_tags (context_id, tag)
+                        VALUES (?, ?)
+                    ''', [(context_id, tag) for tag in tags])
+                conn.commit()
+                if embedding_blob is not None:
+                    self._emb_version += 1
+                return context_id
+            except Exception as e:
+                print(f"Error storing context: {e}")
+                return -1
     
-    def retrieve_similar_contexts(self, query: str, limit: int = 5, 
-                                  min_confidence: float = 0.0) -> List[ContextMemory]:
+    def retrieve_similar_contexts(self, query: str, limit: int = 5,
+                                  min_confidence: float = 0.0,
+                                  query_embedding: List[float] = None) -> List[ContextMemory]:
         """
         Retrieve similar contexts from memory
         Args:
             query: Query to find similar contexts for
             limit: Maximum results
             min_confidence: Minimum confidence score
+            query_embedding: Optional query vector for cosine ranking
         Returns:
             List of similar contexts
         """
         query_hash = self._hash_text(query)
-        
-        conn = sqlite3.connect(self.db_path)
+
+        conn = self._conn
         cursor = conn.cursor()
-        
+
         # First try exact match
         cursor.execute('''
-            SELECT id, query, context, response, metadata, tags, created_at, 
+            SELECT id, query, context, response, metadata, tags, created_at,
                    last_accessed, access_count, confidence_score
-            FROM context_memory 
+            FROM context_memory
             WHERE query_hash = ? AND confidence_score >= ?
             ORDER BY access_count DESC, confidence_score DESC
             LIMIT ?
         ''', (query_hash, min_confidence, limit))
-        
+
         results = cursor.fetchall()
-        
-        # If no exact match, get related contexts
+
+        # No exact match: rank by embedding cosine similarity when a query
+        # vector is supplied, otherwise fall back to the lexical FTS index
+        if not results and query_embedding is not None:
+            results = self._search_by_embedding(cursor, query_embedding,
+                                                min_confidence, limit)
+        if not results:
+            results = self._search_fulltext(cursor, query, min_confidence, limit)
+
+        # Last resort: most recently used contexts
         if not results:
             cursor.execute('''
                 SELECT id, query, context, response, metadata, tags, created_at, 
@@ -196,7 +329,6 @@ class ContextMemoryStore:
             ''', (min_confidence, limit))
             results = cursor.fetchall()
         
-        conn.close()
         
         memories = []
         for row in results:
@@ -218,6 +350,82 @@ class ContextMemoryStore:
         
         return memories
     
+    def _search_by_embedding(self, cursor, query_embedding: List[float],
+                             min_confidence: float, limit: int) -> List[tuple]:
+        """Rank stored contexts by cosine similarity against the query vector.
+
+        Stored vectors are normalized at write time, so scoring all N rows
+        is a single [N, D] @ [D] matrix-vector product over a cached matrix.
+        """
+        # Imported lazily: the memory layer stays usable without numpy
+        # unless embedding retrieval is actually exercised
+        import numpy as np
+
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return []
+        q /= q_norm
+        dim = q.shape[0]
+
+        cached = self._emb_cache.get(dim)
+        if cached is None or cached[0] != self._emb_version:
+            cursor.execute('''
+                SELECT id, embedding FROM context_memory
+                WHERE embedding IS NOT NULL AND embed_dim = ?
+            ''', (dim,))
+            rows = cursor.fetchall()
+            if not rows:
+                return []
+            ids = [row[0] for row in rows]
+            matrix = np.frombuffer(b"".join(row[1] for row in rows),
+                                   dtype=np.float32).reshape(len(ids), dim)
+            cached = (self._emb_version, ids, matrix)
+            self._emb_cache[dim] = cached
+        _, ids, matrix = cached
+
+        scores = matrix @ q
+        top_k = min(limit, len(ids))
+        top_idx = np.argpartition(scores, -top_k)[-top_k:]
+        top_idx = top_idx[np.argsort(scores[top_idx])[::-1]]
+        ranked_ids = [ids[i] for i in top_idx]
+
+        placeholders = ",".join("?" * len(ranked_ids))
+        cursor.execute(f'''
+            SELECT id, query, context, response, metadata, tags, created_at,
+                   last_accessed, access_count, confidence_score
+            FROM context_memory
+            WHERE id IN ({placeholders}) AND confidence_score >= ?
+        ''', (*ranked_ids, min_confidence))
+        by_id = {row[0]: row for row in cursor.fetchall()}
+        return [by_id[cid] for cid in ranked_ids if cid in by_id]
+
+    def _search_fulltext(self, cursor, query: str, min_confidence: float,
+                         limit: int) -> List[tuple]:
+        """BM25-rank stored contexts against the query using the FTS index"""
+        if not self._fts_enabled:
+            return []
+
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        match_expr = " OR ".join(f'"{term}"' for term in terms)
+
+        try:
+            cursor.execute('''
+                SELECT cm.id, cm.query, cm.context, cm.response, cm.metadata, cm.tags,
+                       cm.created_at, cm.last_accessed, cm.access_count, cm.confidence_score
+                FROM context_fts
+                JOIN context_memory cm ON cm.id = context_fts.rowid
+                WHERE context_fts MATCH ? AND cm.confidence_score >= ?
+                ORDER BY bm25(context_fts)
+                LIMIT ?
+            ''', (match_expr, min_confidence, limit))
+            return cursor.fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"[WARN] FTS query failed: {e}")
+            return []
+
     def get_memory_by_tags(self, tags: List[str], limit: int = 10) -> List[ContextMemory]:
         """
         Retrieve contexts by tags
@@ -227,37 +435,39 @@ class ContextMemoryStore:
         Returns:
             List of contexts with matching tags
         """
-        conn = sqlite3.connect(self.db_path)
+        if not tags:
+            return []
+
+        conn = self._conn
         cursor = conn.cursor()
-        
+
+        placeholders = ",".join("?" * len(tags))
+        cursor.execute(f'''
+            SELECT DISTINCT cm.id, cm.query, cm.context, cm.response, cm.metadata, cm.tags,
+                   cm.created_at, cm.last_accessed, cm.access_count, cm.confidence_score
+            FROM context_memory cm
+            JOIN context_tags ct ON ct.context_id = cm.id
+            WHERE ct.tag IN ({placeholders})
+            ORDER BY cm.access_count DESC
+            LIMIT ?
+        ''', (*tags, limit))
+
         memories = []
-        for tag in tags:
-            cursor.execute('''
-                SELECT id, query, context, response, metadata, tags, created_at, 
-                       last_accessed, access_count, confidence_score
-                FROM context_memory 
-                WHERE tags LIKE ?
-                ORDER BY access_count DESC
-                LIMIT ?
-            ''', (f'%{tag}%', limit))
-            
-            results = cursor.fetchall()
-            for row in results:
-                memory = ContextMemory(
-                    id=row[0],
-                    query=row[1],
-                    context=row[2],
-                    response=row[3],
-                    metadata=json.loads(row[4]) if row[4] else {},
-                    tags=json.loads(row[5]) if row[5] else [],
-                    created_at=row[6],
-                    last_accessed=row[7],
-                    access_count=row[8],
-                    confidence_score=row[9]
-                )
-                memories.append(memory)
-        
-        conn.close()
+        for row in cursor.fetchall():
+            memory = ContextMemory(
+                id=row[0],
+                query=row[1],
+                context=row[2],
+                response=row[3],
+                metadata=json.loads(row[4]) if row[4] else {},
+                tags=json.loads(row[5]) if row[5] else [],
+                created_at=row[6],
+                last_accessed=row[7],
+                access_count=row[8],
+                confidence_score=row[9]
+            )
+            memories.append(memory)
+
         return memories
     
     def create_conversation_thread(self, thread_id: str, title: str = None) -> bool:
@@ -269,19 +479,18 @@ class ContextMemoryStore:
         Returns:
             Success status
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-                INSERT INTO conversation_threads (thread_id, title, context_ids)
-                VALUES (?, ?, '[]')
-            ''', (thread_id, title))
-            conn.commit()
-            conn.close()
+            with self._lock:
+                cursor.execute('''
+                    INSERT INTO conversation_threads (thread_id, title)
+                    VALUES (?, ?)
+                ''', (thread_id, title))
+                conn.commit()
             return True
         except sqlite3.IntegrityError:
-            conn.close()
             return False
     
     def add_to_thread(self, thread_id: str, context_id: int) -> bool:
@@ -293,36 +502,32 @@ class ContextMemoryStore:
         Returns:
             Success status
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-                SELECT context_ids FROM conversation_threads WHERE thread_id = ?
-            ''', (thread_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                context_ids = json.loads(result[0])
-                if context_id not in context_ids:
-                    context_ids.append(context_id)
+            with self._lock:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO thread_contexts (thread_id, context_id, position)
+                    SELECT ?, ?, COALESCE(MAX(position) + 1, 0)
+                    FROM thread_contexts WHERE thread_id = ?
+                ''', (thread_id, context_id, thread_id))
+                if cursor.rowcount:
                     cursor.execute('''
-                        UPDATE conversation_threads 
-                        SET context_ids = ?, last_updated = CURRENT_TIMESTAMP
+                        UPDATE conversation_threads
+                        SET last_updated = CURRENT_TIMESTAMP
                         WHERE thread_id = ?
-                    ''', (json.dumps(context_ids), thread_id))
-                    conn.commit()
-            
-            conn.close()
+                    ''', (thread_id,))
+                conn.commit()
+
             return True
         except Exception as e:
             print(f"Error adding to thread: {e}")
-            conn.close()
             return False
     
     def get_memory_stats(self) -> Dict:
         """Get statistics about memory store"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
         
         cursor.execute('SELECT COUNT(*) FROM context_memory')
@@ -343,7 +548,6 @@ class ContextMemoryStore:
         ''')
         recent_contexts = cursor.fetchone()[0]
         
-        conn.close()
         
         return {
             "total_contexts": total_contexts,
@@ -362,17 +566,21 @@ class ContextMemoryStore:
         Returns:
             Number of contexts deleted
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
         
-        date_threshold = datetime.now() - timedelta(days=days)
-        cursor.execute('''
-            DELETE FROM context_memory 
-            WHERE created_at < ? AND access_count < 5
-        ''', (date_threshold,))
-        
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
-        
+        # ISO text matching CURRENT_TIMESTAMP's stored format keeps the
+        # comparison sargable (plain text compare, no type coercion)
+        date_threshold = (datetime.utcnow() - timedelta(days=days)).isoformat(sep=' ', timespec='seconds')
+        with self._lock:
+            cursor.execute('''
+                DELETE FROM context_memory 
+                WHERE created_at < ? AND access_count < 5
+            ''', (date_threshold,))
+
+            deleted = cursor.rowcount
+            conn.commit()
+            if deleted:
+                self._emb_version += 1
+
         return deleted
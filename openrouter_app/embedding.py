@@ -1,7 +1,12 @@
-import json
 import numpy as np
 from .openrouter_client import get_openrouter_client
 
+try:
+    # Optional fast JSON parser; embedding responses can run to megabytes
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
 def embed_with_openrouter(model_id, input_text):
     """
     Generate embeddings using OpenRouter (OpenAI text-embedding models).
@@ -16,21 +21,15 @@ def embed_with_openrouter(model_id, input_text):
     try:
         client = get_openrouter_client()
 
-        headers = {
-            "Authorization": f"Bearer {client['api_key']}",
-            "HTTP-Referer": "http://localhost:8501",
-            "Content-Type": "application/json"
-        }
-
         payload = {
             "model": model_id,
             "input": input_text
         }
 
+        # Auth/referer headers are pre-set on the shared session
         response = client["session"].post(
             f"{client['base_url']}/embeddings",
             json=payload,
-            headers=headers,
             timeout=60
         )
 
@@ -38,7 +37,7 @@ def embed_with_openrouter(model_id, input_text):
             print(f"Error generating embedding: {response.status_code} - {response.text}")
             return []
 
-        response_data = response.json()
+        response_data = _json_loads(response.content)
 
         if "data" in response_data and len(response_data["data"]) > 0:
             return response_data["data"][0].get("embedding", [])
@@ -51,10 +50,105 @@ def embed_with_openrouter(model_id, input_text):
         return []
 
 
+# Texts per batched embedding request; halved on 413/5xx responses
+EMBED_BATCH_SIZE = 32
+
+
+def embed_batch_with_openrouter(model_id, texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Generate embeddings for several texts, batched into single requests.
+
+    One POST carries up to batch_size inputs, amortizing TLS/auth overhead
+    and letting the provider batch the forward pass. Oversized or failing
+    batches are split in half and retried; a batch that cannot be embedded
+    contributes [] per text, matching embed_with_openrouter's failure value.
+
+    Args:
+        model_id: OpenRouter embedding model ID
+        texts: List of texts to embed
+        batch_size: Maximum inputs per request
+
+    Returns:
+        List of embedding vectors, one per input text, in input order
+    """
+    results = []
+    for start in range(0, len(texts), batch_size):
+        results.extend(_embed_batch(model_id, texts[start:start + batch_size]))
+    return results
+
+
+def _embed_batch(model_id, batch):
+    """Embed one batch, splitting and retrying on failure"""
+    try:
+        client = get_openrouter_client()
+
+        response = client["session"].post(
+            f"{client['base_url']}/embeddings",
+            json={"model": model_id, "input": batch},
+            timeout=120
+        )
+
+        if response.status_code == 200:
+            data = _json_loads(response.content).get("data", [])
+            if len(data) == len(batch):
+                data.sort(key=lambda d: d["index"])
+                return [d.get("embedding", []) for d in data]
+            print(f"Batch embedding returned {len(data)} rows for {len(batch)} inputs")
+        else:
+            print(f"Error generating batch embedding: {response.status_code} - {response.text}")
+
+        # Payload too large, server error, or row mismatch: halve and retry,
+        # degrading to per-text requests at batch size 1
+        if len(batch) > 1:
+            half = len(batch) // 2
+            return _embed_batch(model_id, batch[:half]) + _embed_batch(model_id, batch[half:])
+        return [embed_with_openrouter(model_id, batch[0])]
+
+    except Exception as e:
+        print(f"Error generating batch embedding: {e}")
+        return [[] for _ in batch]
+
+
+# Small in-process cache so repeated queries skip the embedding API call
+_query_embedding_cache = {}
+_QUERY_CACHE_MAX_ENTRIES = 1024
+
+
+def embed_query(model_id, query_text):
+    """
+    Embed a query, reusing cached vectors for repeated queries.
+
+    Queries are normalized (lowercased, whitespace-collapsed) before being
+    used as a cache key, so trivially equivalent phrasings share one vector.
+
+    Args:
+        model_id: OpenRouter embedding model ID
+        query_text: Query text to embed
+
+    Returns:
+        List of floats representing the embedding vector
+    """
+    key = (model_id, " ".join(query_text.lower().split()))
+    embedding = _query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = embed_with_openrouter(model_id, key[1])
+        if embedding:
+            if len(_query_embedding_cache) >= _QUERY_CACHE_MAX_ENTRIES:
+                _query_embedding_cache.pop(next(iter(_query_embedding_cache)))
+            _query_embedding_cache[key] = embedding
+    return embedding
+
+
 def cosine_similarity(vec1, vec2):
-    """Calculate cosine similarity between two vectors"""
-    v1 = np.array(vec1)
-    v2 = np.array(vec2)
+    """Calculate cosine similarity between two vectors.
+
+    Scalar helper only — retrieval paths score whole corpora with a single
+    matrix-vector product over pre-normalized rows instead of calling this
+    per pair.
+    """
+    # asarray avoids a copy when the inputs are already ndarrays
+    v1 = np.asarray(vec1, dtype=np.float32)
+    v2 = np.asarray(vec2, dtype=np.float32)
     dot_product = np.dot(v1, v2)
     norm1 = np.linalg.norm(v1)
     norm2 = np.linalg.norm(v2)
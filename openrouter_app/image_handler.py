@@ -5,7 +5,6 @@ Handles text extraction from image files using EasyOCR
 
 import os
 from PIL import Image
-import easyocr
 from typing import Optional
 
 # Initialize reader globally for performance (lazy loading)
@@ -15,6 +14,10 @@ def get_ocr_reader():
     """Get or initialize the OCR reader (lazy loading for performance)"""
     global _ocr_reader
     if _ocr_reader is None:
+        # easyocr (and the torch stack underneath it) imports only when OCR
+        # is actually used, keeping it off the app's cold-start path
+        import easyocr
+
         print("[INFO] Initializing OCR reader (first use)...")
         _ocr_reader = easyocr.Reader(['en'], gpu=False)
     return _ocr_reader
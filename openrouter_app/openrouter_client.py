@@ -1,5 +1,25 @@
 import os
+import functools
 import requests
+from requests.adapters import HTTPAdapter, Retry
+
+
+@functools.lru_cache(maxsize=1)
+def _get_session() -> requests.Session:
+    """Shared Session so every API call reuses pooled keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # Static headers live on the session so callers need not rebuild them
+    session.headers["HTTP-Referer"] = "http://localhost:8501"  # Streamlit default port
+    session.headers["Content-Type"] = "application/json"
+    return session
+
 
 def get_openrouter_client():
     """Initialize OpenRouter HTTP client with API key from environment"""
@@ -10,27 +30,26 @@ def get_openrouter_client():
             "Please set your OpenRouter API key: set OPENROUTER_API_KEY=your_key"
         )
 
+    session = _get_session()
+    # Pre-set auth on the shared session; idempotent, and per-call header
+    # dicts become unnecessary
+    session.headers["Authorization"] = f"Bearer {api_key}"
+
     return {
         "api_key": api_key,
         "base_url": "https://openrouter.ai/api/v1",
-        "session": requests.Session()
+        "session": session
     }
 
 def test_openrouter_connection():
     """Test if OpenRouter API is accessible"""
     try:
         client = get_openrouter_client()
-        headers = {
-            "Authorization": f"Bearer {client['api_key']}",
-            "HTTP-Referer": "http://localhost:8501",  # Streamlit default port
-        }
         response = client["session"].get(
             f"{client['base_url']}/models",
-            headers=headers,
             timeout=5
         )
         return response.status_code == 200
     except Exception as e:
         print(f"Error testing OpenRouter connection: {e}")
         return False
-
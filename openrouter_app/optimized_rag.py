@@ -2,13 +2,53 @@
 Optimized RAG with CAG and Memory Integration
 Combines pre-vectorization, cache-augmented generation, and memory layer
 """
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 from .vector_store_manager import VectorStoreManager
 from .prompt_cache import PromptCache
 from .context_memory import ContextMemoryStore
 from .system_prompt import load_system_prompt
+from .embedding import embed_query
 from .chat import invoke_model_stream, invoke_model_with_fallback, chat_with_openrouter
 
+# Shared pool so cache writes overlap with model invocation instead of
+# blocking the request path
+_cache_writer = ThreadPoolExecutor(max_workers=2)
+
+# Pool for overlapping the independent retrieval stages after a cache miss
+_retrieval_pool = ThreadPoolExecutor(max_workers=2)
+
+# Tag vocabulary compiled to one alternation so a question is scanned once
+# instead of once per keyword
+_TAG_KEYWORDS = {
+    "implementation": ["how", "build", "create", "develop"],
+    "explanation": ["what", "explain", "describe", "why"],
+    "troubleshooting": ["error", "bug", "fix", "issue", "problem"],
+    "design": ["architecture", "design", "pattern", "structure"],
+}
+_KEYWORD_TO_TAG = {
+    word: category for category, words in _TAG_KEYWORDS.items() for word in words
+}
+_TAG_RE = re.compile(r"\b(" + "|".join(_KEYWORD_TO_TAG) + r")\b")
+
+try:
+    # Optional: real token counts when tiktoken is installed; the encoder
+    # build can also fail offline, in which case the estimate is kept
+    import tiktoken
+    _TOKEN_ENCODER = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _TOKEN_ENCODER = None
+
+
+def _estimate_tokens(text: str) -> int:
+    """Count tokens in text, or estimate from word count without tiktoken"""
+    if _TOKEN_ENCODER is not None:
+        return len(_TOKEN_ENCODER.encode(text, disallowed_special=()))
+    # Allocation-free stand-in for len(text.split()) // 4
+    return (text.count(" ") + 1) // 4
+
 class OptimizedRAG:
     """Integrated RAG system with vectorization, caching, and memory"""
 
@@ -16,6 +56,14 @@ class OptimizedRAG:
         self.vector_store_manager = VectorStoreManager()
         self.prompt_cache = PromptCache()
         self.memory_store = ContextMemoryStore()
+        # The system prompt is fixed for the lifetime of this instance;
+        # load it once and keep the ready-made message dict so neither is
+        # rebuilt per question
+        self._system_prompt = load_system_prompt()
+        self._sys_msg = (
+            {"role": "system", "content": self._system_prompt}
+            if self._system_prompt else None
+        )
 
     def initialize_knowledge_base(self, folder_path: str, embed_model_id: str) -> Dict:
         """Initialize pre-vectorized knowledge base"""
@@ -52,17 +100,32 @@ class OptimizedRAG:
                     "from_cache": True
                 }
 
+        # Embed the question once; the same cached vector backs memory
+        # similarity, semantic search, and the stored row
+        query_embedding = embed_query(embed_model_id, user_question) or None
+
+        # Memory retrieval and semantic search are independent once the
+        # query vector exists; kick the search off so it overlaps the
+        # memory scan instead of waiting behind it
+        search_future = _retrieval_pool.submit(
+            self.vector_store_manager.semantic_search,
+            user_question, embed_model_id, top_k=3
+        )
+
         past_contexts = []
         if retrieve_past_contexts:
-            past_contexts = self.memory_store.retrieve_similar_contexts(user_question, limit=3)
+            past_contexts = self.memory_store.retrieve_similar_contexts(
+                user_question, limit=3, query_embedding=query_embedding
+            )
             if past_contexts:
                 print(f"[MEM] Found {len(past_contexts)} similar contexts from memory")
                 stats["memory_reused"] = True
                 stats["optimization_source"].append("context_memory")
                 
                 # Check for exact match and return it directly
+                needle = user_question.strip().casefold()
                 for past_ctx in past_contexts:
-                    if past_ctx.query.strip().lower() == user_question.strip().lower():
+                    if past_ctx.query.strip().casefold() == needle:
                         print(f"[MEM] Exact match found! Returning cached response")
                         return {
                             "response": past_ctx.response,
@@ -70,32 +133,28 @@ class OptimizedRAG:
                             "from_memory": True
                         }
 
-        retrieved_results = self.vector_store_manager.semantic_search(
-            user_question, embed_model_id, top_k=3
-        )
+        retrieved_results = search_future.result()
         stats["contexts_retrieved"] = len(retrieved_results)
         print(f"[SEARCH] Retrieved {len(retrieved_results)} relevant documents")
 
-        context_parts = []
-
-        for past_ctx in past_contexts:
-            context_parts.append(f"[Memory - Confidence: {past_ctx.confidence_score:.2%}]")
-            context_parts.append(past_ctx.response)
-            context_parts.append("")
-
+        # Assemble the context in one pass: the comprehensions build exactly
+        # the list join consumes, without incremental append/resize traffic.
+        # Retrieved entries are document chunks; each full chunk goes in.
+        context_parts = [
+            part
+            for past_ctx in past_contexts
+            for part in (f"[Memory - Confidence: {past_ctx.confidence_score:.2%}]",
+                         past_ctx.response, "")
+        ]
+        # One pass over the retrieved results feeds both the context and
+        # the batched chunk-cache write
+        chunk_rows = []
         for filename, score, content in retrieved_results:
-            context_parts.append(f"[Document: {filename}]")
-            # retrieved entries are now document chunks; include full chunk
-            context_parts.append(content)
-            context_parts.append("")
-
+            context_parts += (f"[Document: {filename}]", content, "")
+            chunk_rows.append((content, {"source": filename, "score": score}))
         combined_context = "\n".join(context_parts)
 
-        for filename, score, content in retrieved_results:
-            self.prompt_cache.cache_context_chunk(
-                content,
-                {"source": filename, "score": score}
-            )
+        _cache_writer.submit(self.prompt_cache.cache_context_chunks_batch, chunk_rows)
 
         response = self._invoke_model_with_context(
             model_id, user_question, combined_context, message_history,
@@ -110,7 +169,7 @@ class OptimizedRAG:
             }
 
         if use_cache:
-            estimated_tokens_saved = len(combined_context.split()) // 4
+            estimated_tokens_saved = _estimate_tokens(combined_context)
             self.prompt_cache.cache_response(
                 user_question, combined_context, response, model_id,
                 tokens_saved=estimated_tokens_saved
@@ -133,7 +192,8 @@ class OptimizedRAG:
                 },
                 tags=tags,
                 confidence_score=confidence_score,
-                model_id=model_id
+                model_id=model_id,
+                embedding=query_embedding
             )
             print(f"[SAVED] Stored in memory (ID: {context_id})")
             stats["optimization_source"].append("memory_stored")
@@ -153,33 +213,27 @@ class OptimizedRAG:
             message_history = []
 
         try:
-            system_prompt = load_system_prompt()
-
             # Build OpenAI-format messages for OpenRouter
             messages = []
 
             # Add system prompt as first message with system role
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
+            if self._sys_msg:
+                messages.append(self._sys_msg)
 
             # Add message history if present
             if message_history:
                 messages.extend(message_history)
 
-            # Add user question with context
+            # Question first, dynamic retrieved context at the end of the
+            # turn, so the shared prompt prefix stays stable across turns
             messages.append({
                 "role": "user",
-                "content": f"Context:\n{context}\n\nQuestion:\n{user_question}"
+                "content": f"{user_question}\n\n<context>\n{context}\n</context>"
             })
 
-
             response = chat_with_openrouter(
                 model_id,
-                "",  # Message is already in messages list
-                message_history=messages[:-1],  # Pass all but last as history
+                messages=messages,
                 temperature=temperature,
                 top_p=top_p
             )
@@ -200,20 +254,10 @@ class OptimizedRAG:
 
     def _extract_tags(self, question: str) -> List[str]:
         """Extract tags from question for categorization"""
-        tags = []
-        keywords = {
-            "implementation": ["how", "build", "create", "develop"],
-            "explanation": ["what", "explain", "describe", "why"],
-            "troubleshooting": ["error", "bug", "fix", "issue", "problem"],
-            "design": ["architecture", "design", "pattern", "structure"]
-        }
-
-        question_lower = question.lower()
-        for category, words in keywords.items():
-            if any(word in question_lower for word in words):
-                tags.append(category)
-
-        return tags[:3]  # Limit to 3 tags
+        categories = dict.fromkeys(
+            _KEYWORD_TO_TAG[match] for match in _TAG_RE.findall(question.lower())
+        )
+        return list(categories)[:3]  # Limit to 3 tags
 
     def get_optimization_stats(self) -> Dict:
         """Get statistics about all optimization systems"""
@@ -257,69 +301,89 @@ class OptimizedRAG:
                 stats["cache_hit"] = True
                 stats["tokens_saved"] = cached_response['tokens_saved']
                 stats["optimization_source"].append("prompt_cache")
-                # Yield cached response character by character to preserve formatting
-                for char in cached_response['response']:
-                    yield char, stats.copy()
+                # A single yield: the UI renders the full cached text at once
+                yield cached_response['response'], stats
                 return
 
+        # Embed the question once; the same cached vector backs memory
+        # similarity, semantic search, and the stored row
+        query_embedding = embed_query(embed_model_id, user_question) or None
+
+        # Overlap the vector store search with the memory scan below
+        search_future = _retrieval_pool.submit(
+            self.vector_store_manager.semantic_search,
+            user_question, embed_model_id, top_k=3
+        )
+
         # Retrieve past contexts
         past_contexts = []
         if retrieve_past_contexts:
-            past_contexts = self.memory_store.retrieve_similar_contexts(user_question, limit=3)
+            past_contexts = self.memory_store.retrieve_similar_contexts(
+                user_question, limit=3, query_embedding=query_embedding
+            )
             if past_contexts:
                 print(f"[MEM] Found {len(past_contexts)} similar contexts from memory")
                 stats["memory_reused"] = True
                 stats["optimization_source"].append("context_memory")
                 
                 # If we have an exact match from memory, return it directly with formatting preserved
+                needle = user_question.strip().casefold()
                 for past_ctx in past_contexts:
-                    if past_ctx.query.strip().lower() == user_question.strip().lower():
-                        print(f"[MEM] Exact match found! Returning cached response with formatting")
-                        # Yield the cached response character by character to preserve formatting
-                        for char in past_ctx.response:
-                            yield char, stats.copy()
+                    if past_ctx.query.strip().casefold() == needle:
+                        print(f"[MEM] Exact match found! Returning cached response")
+                        yield past_ctx.response, stats
                         return
 
         # Retrieve from vector store
-        retrieved_results = self.vector_store_manager.semantic_search(
-            user_question, embed_model_id, top_k=3
-        )
+        retrieved_results = search_future.result()
         stats["contexts_retrieved"] = len(retrieved_results)
         print(f"[SEARCH] Retrieved {len(retrieved_results)} relevant documents")
 
-        # Build combined context
-        context_parts = []
-        for past_ctx in past_contexts:
-            context_parts.append(f"[Memory - Confidence: {past_ctx.confidence_score:.2%}]")
-            context_parts.append(past_ctx.response)
-            context_parts.append("")
-
+        # Build combined context in one pass (see answer_with_optimization)
+        context_parts = [
+            part
+            for past_ctx in past_contexts
+            for part in (f"[Memory - Confidence: {past_ctx.confidence_score:.2%}]",
+                         past_ctx.response, "")
+        ]
+        # One pass over the retrieved results feeds both the context and
+        # the chunk-cache write (one transaction, off the request path)
+        chunk_rows = []
         for filename, score, content in retrieved_results:
-            context_parts.append(f"[Document: {filename}]")
-            context_parts.append(content)
-            context_parts.append("")
-
+            context_parts += (f"[Document: {filename}]", content, "")
+            chunk_rows.append((content, {"source": filename, "score": score}))
         combined_context = "\n".join(context_parts)
 
-        # Cache context chunks
-        for filename, score, content in retrieved_results:
-            self.prompt_cache.cache_context_chunk(
-                content,
-                {"source": filename, "score": score}
-            )
+        _cache_writer.submit(self.prompt_cache.cache_context_chunks_batch, chunk_rows)
 
-        # Stream response from model
-        full_response = ""
+        # Stream response from model; accumulate in a list to avoid the
+        # quadratic cost of repeated string concatenation. Deltas coalesce
+        # into ~50 Hz flushes (20 ms or 32 deltas, whichever first) so a
+        # fast stream does not resume the consumer once per token.
+        response_parts = []
+        pending = []
+        last_flush = time.monotonic()
         for token in self._invoke_model_with_context_stream(
             model_id, user_question, combined_context, message_history,
             temperature, top_p
         ):
-            full_response += token
-            yield token, stats.copy()
+            response_parts.append(token)
+            pending.append(token)
+            now = time.monotonic()
+            if len(pending) >= 32 or now - last_flush >= 0.02:
+                # stats does not change while the model streams, so the
+                # shared dict goes out as-is; the post-stream updates below
+                # run after the last flush
+                yield "".join(pending), stats
+                pending.clear()
+                last_flush = now
+        if pending:
+            yield "".join(pending), stats
+        full_response = "".join(response_parts)
 
         # Cache the response for future use
         if use_cache:
-            estimated_tokens_saved = len(combined_context.split()) // 4
+            estimated_tokens_saved = _estimate_tokens(combined_context)
             self.prompt_cache.cache_response(
                 user_question, combined_context, full_response, model_id,
                 tokens_saved=estimated_tokens_saved
@@ -343,7 +407,8 @@ class OptimizedRAG:
                 },
                 tags=tags,
                 confidence_score=confidence_score,
-                model_id=model_id
+                model_id=model_id,
+                embedding=query_embedding
             )
             print(f"[SAVED] Stored in memory (ID: {context_id})")
             stats["optimization_source"].append("memory_stored")
@@ -356,8 +421,6 @@ class OptimizedRAG:
         Yields:
             Text tokens from the model response
         """
-        system_prompt = load_system_prompt()
-
         if message_history is None:
             message_history = []
 
@@ -366,24 +429,22 @@ class OptimizedRAG:
             messages = []
 
             # Add system prompt as first message with system role
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
+            if self._sys_msg:
+                messages.append(self._sys_msg)
 
             # Add message history if present
             if message_history:
                 messages.extend(message_history)
 
-            # Add user question with context
+            # Question first, dynamic retrieved context at the end of the
+            # turn, so the shared prompt prefix stays stable across turns
             messages.append({
                 "role": "user",
-                "content": f"Context:\n{context}\n\nQuestion:\n{user_question}"
+                "content": f"{user_question}\n\n<context>\n{context}\n</context>"
             })
 
             # Use streaming invoke with fallback
-            for token in invoke_model_with_fallback(model_id, messages, temperature, top_p, character_stream=True):
+            for token in invoke_model_with_fallback(model_id, messages, temperature, top_p):
                 yield token
 
         except Exception as e:
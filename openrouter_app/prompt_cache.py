@@ -2,24 +2,67 @@
 Cache-Augmented Generation (CAG) - Prompt Caching System
 Implements context caching to reduce token consumption and improve response consistency
 """
+import atexit
+import collections
 import json
 import hashlib
+import re
+import threading
+import unicodedata
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 import sqlite3
 from pathlib import Path
 
+
+def _canonicalize_query(text: str) -> str:
+    """Normalize a query so trivially equivalent phrasings share a cache key"""
+    text = unicodedata.normalize("NFC", text).strip().lower()
+    return re.sub(r"\s+", " ", text).rstrip("?!. ")
+
 class PromptCache:
     """Manages cached prompts and responses for CAG"""
     
     def __init__(self, db_path: str = "./.cag_cache/prompts.db"):
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(exist_ok=True)
+        # Single shared connection; per-call connect/close dominated the
+        # sub-millisecond lookups on the cache-hit path. Chunk writes run on
+        # worker threads, so every use of the connection takes the lock.
+        # cached_statements keeps every query in this module prepared across
+        # calls, skipping SQL re-parse/re-plan on the persistent connection
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                     cached_statements=128)
+        self._lock = threading.RLock()
+        # Tiny LRU in front of SQLite for repeat lookups within a session:
+        # a dict hit is ~1000x cheaper than even a WAL-mode SELECT
+        self._mem = collections.OrderedDict()
+        self._mem_cap = 256
+        atexit.register(self.close)
+        self._configure_connection()
         self._init_db()
-    
+
+    def _configure_connection(self):
+        """Apply performance PRAGMAs once on the shared connection"""
+        cursor = self._conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA mmap_size=268435456')
+        cursor.execute('PRAGMA cache_size=-65536')
+
+    def close(self):
+        """Close the shared database connection"""
+        with self._lock:
+            try:
+                self._conn.execute('PRAGMA optimize')
+            except sqlite3.Error:
+                pass
+            self._conn.close()
+
     def _init_db(self):
         """Initialize SQLite database for prompt caching"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -48,9 +91,22 @@ class PromptCache:
                 reuse_count INTEGER DEFAULT 1
             )
         ''')
-        
+
+        # Covering index for the cache-hit probe: the (query_hash,
+        # context_hash) lookup is answered entirely from the index without
+        # touching the (wide) table rows
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_prompt_qh_ch
+            ON cached_prompts(query_hash, context_hash, response, tokens_saved, access_count)
+        ''')
+
+        # Index so frequently-reused chunk lookups avoid a full table sort
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chunks_reuse_count
+            ON context_chunks(reuse_count DESC)
+        ''')
+
         conn.commit()
-        conn.close()
     
     @staticmethod
     def _hash_text(text: str) -> str:
@@ -68,78 +124,124 @@ class PromptCache:
         """
         chunk_hash = self._hash_text(content)
         metadata_json = json.dumps(metadata) if metadata else None
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO context_chunks (chunk_hash, chunk_content, chunk_metadata)
+                    VALUES (?, ?, ?)
+                ''', (chunk_hash, content, metadata_json))
+                self._conn.commit()
+            except sqlite3.IntegrityError:
+                # Update reuse count if already cached
+                cursor.execute('''
+                    UPDATE context_chunks 
+                    SET reuse_count = reuse_count + 1
+                    WHERE chunk_hash = ?
+                ''', (chunk_hash,))
+                self._conn.commit()
+
+        return chunk_hash
+
+    def cache_context_chunks_batch(self, items: List[Tuple[str, Dict]]) -> List[str]:
+        """
+        Cache several context chunks in a single transaction
+        Args:
+            items: List of (content, metadata) pairs
+        Returns:
+            Hashes of the cached chunks
+        """
+        if not items:
+            return []
+
+        hashes = []
+        rows = []
+        for content, metadata in items:
+            chunk_hash = self._hash_text(content)
+            hashes.append(chunk_hash)
+            rows.append((chunk_hash, content, json.dumps(metadata) if metadata else None))
+
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.executemany('''
                 INSERT INTO context_chunks (chunk_hash, chunk_content, chunk_metadata)
                 VALUES (?, ?, ?)
-            ''', (chunk_hash, content, metadata_json))
-            conn.commit()
-        except sqlite3.IntegrityError:
-            # Update reuse count if already cached
-            cursor.execute('''
-                UPDATE context_chunks 
-                SET reuse_count = reuse_count + 1
-                WHERE chunk_hash = ?
-            ''', (chunk_hash,))
-            conn.commit()
-        
-        conn.close()
-        return chunk_hash
-    
-    def get_cached_response(self, query: str, context: str = None) -> Optional[Dict]:
+                ON CONFLICT(chunk_hash) DO UPDATE SET reuse_count = reuse_count + 1
+            ''', rows)
+            self._conn.commit()
+
+        return hashes
+
+    def get_cached_response(self, query: str, context: str = None,
+                            context_hash: str = None) -> Optional[Dict]:
         """
         Retrieve cached response if available
         Args:
             query: User query
             context: Optional context text
+            context_hash: Optional precomputed hash of the context (skips rehashing)
         Returns:
             Cached response dict or None
         """
-        query_hash = self._hash_text(query)
-        context_hash = self._hash_text(context) if context else None
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if context_hash:
-            cursor.execute('''
-                SELECT response, tokens_saved, access_count FROM cached_prompts
-                WHERE query_hash = ? AND context_hash = ?
-            ''', (query_hash, context_hash))
-        else:
-            cursor.execute('''
-                SELECT response, tokens_saved, access_count FROM cached_prompts
-                WHERE query_hash = ?
-            ''', (query_hash,))
-        
-        result = cursor.fetchone()
-        
-        if result:
-            # Update access stats
-            cursor.execute('''
-                UPDATE cached_prompts 
-                SET last_accessed = CURRENT_TIMESTAMP, access_count = access_count + 1
-                WHERE query_hash = ?
-            ''', (query_hash,))
-            conn.commit()
-            conn.close()
-            
-            return {
-                "response": result[0],
-                "tokens_saved": result[1],
-                "access_count": result[2],
-                "cached": True
-            }
-        
-        conn.close()
+        query_hash = self._hash_text(_canonicalize_query(query))
+        if context_hash is None:
+            context_hash = self._hash_text(context) if context else None
+
+        mem_key = (query_hash, context_hash)
+        with self._lock:
+            cached = self._mem.get(mem_key)
+            if cached is not None:
+                self._mem.move_to_end(mem_key)
+                return dict(cached)
+
+            cursor = self._conn.cursor()
+            if context_hash:
+                cursor.execute('''
+                    SELECT response, tokens_saved, access_count FROM cached_prompts
+                    WHERE query_hash = ? AND context_hash = ?
+                ''', (query_hash, context_hash))
+            else:
+                cursor.execute('''
+                    SELECT response, tokens_saved, access_count FROM cached_prompts
+                    WHERE query_hash = ?
+                ''', (query_hash,))
+
+            result = cursor.fetchone()
+
+            if result:
+                # Update access stats
+                cursor.execute('''
+                    UPDATE cached_prompts 
+                    SET last_accessed = CURRENT_TIMESTAMP, access_count = access_count + 1
+                    WHERE query_hash = ?
+                ''', (query_hash,))
+                self._conn.commit()
+
+                hit = {
+                    "response": result[0],
+                    "tokens_saved": result[1],
+                    "access_count": result[2],
+                    "cached": True
+                }
+                self._remember(mem_key, hit)
+                return hit
+
         return None
+
+    def _remember(self, mem_key, hit: Dict):
+        """Insert into the in-memory LRU, evicting the oldest over capacity.
+
+        Callers must hold self._lock.
+        """
+        self._mem[mem_key] = hit
+        self._mem.move_to_end(mem_key)
+        if len(self._mem) > self._mem_cap:
+            self._mem.popitem(last=False)
     
-    def cache_response(self, query: str, context: str, response: str, 
-                      model_id: str, tokens_saved: int = 0) -> bool:
+    def cache_response(self, query: str, context: str, response: str,
+                      model_id: str, tokens_saved: int = 0,
+                      context_hash: str = None) -> bool:
         """
         Cache a response for future reuse
         Args:
@@ -148,31 +250,35 @@ class PromptCache:
             response: Model response
             model_id: Model ID used
             tokens_saved: Estimated tokens saved by using cache
+            context_hash: Optional precomputed hash of the context (skips rehashing)
         Returns:
             Success status
         """
-        query_hash = self._hash_text(query)
-        context_hash = self._hash_text(context) if context else None
+        query_hash = self._hash_text(_canonicalize_query(query))
+        if context_hash is None:
+            context_hash = self._hash_text(context) if context else None
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO cached_prompts 
-                (query_hash, query, context_hash, context, response, model_id, tokens_saved)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (query_hash, query, context_hash, context, response, model_id, tokens_saved))
-            conn.commit()
-            conn.close()
-            return True
-        except sqlite3.IntegrityError:
-            conn.close()
-            return False
-        except Exception as e:
-            print(f"Error caching response: {e}")
-            conn.close()
-            return False
+        with self._lock:
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO cached_prompts 
+                    (query_hash, query, context_hash, context, response, model_id, tokens_saved)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (query_hash, query, context_hash, context, response, model_id, tokens_saved))
+                self._conn.commit()
+                self._remember((query_hash, context_hash), {
+                    "response": response,
+                    "tokens_saved": tokens_saved,
+                    "access_count": 1,
+                    "cached": True
+                })
+                return True
+            except sqlite3.IntegrityError:
+                return False
+            except Exception as e:
+                print(f"Error caching response: {e}")
+                return False
     
     def get_similar_context_chunks(self, query: str, limit: int = 5) -> List[Dict]:
         """
@@ -183,48 +289,43 @@ class PromptCache:
         Returns:
             List of frequently cached chunks
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT chunk_content, chunk_metadata, reuse_count FROM context_chunks
-            ORDER BY reuse_count DESC
-            LIMIT ?
-        ''', (limit,))
-        
-        results = [
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute('''
+                SELECT chunk_content, chunk_metadata, reuse_count FROM context_chunks
+                ORDER BY reuse_count DESC
+                LIMIT ?
+            ''', (limit,))
+            rows = cursor.fetchall()
+
+        return [
             {
                 "content": row[0],
                 "metadata": json.loads(row[1]) if row[1] else None,
                 "reuse_count": row[2]
             }
-            for row in cursor.fetchall()
+            for row in rows
         ]
-        
-        conn.close()
-        return results
     
     def get_cache_stats(self) -> Dict:
         """Get statistics about the cache"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM cached_prompts')
-        prompt_count = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(tokens_saved) FROM cached_prompts')
-        total_tokens_saved = cursor.fetchone()[0] or 0
-        
-        cursor.execute('SELECT SUM(access_count) FROM cached_prompts')
-        total_hits = cursor.fetchone()[0] or 0
-        
-        cursor.execute('SELECT COUNT(*) FROM context_chunks')
-        chunk_count = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(reuse_count) FROM context_chunks')
-        total_chunk_reuses = cursor.fetchone()[0] or 0
-        
-        conn.close()
+        with self._lock:
+            cursor = self._conn.cursor()
+
+            cursor.execute('SELECT COUNT(*) FROM cached_prompts')
+            prompt_count = cursor.fetchone()[0]
+
+            cursor.execute('SELECT SUM(tokens_saved) FROM cached_prompts')
+            total_tokens_saved = cursor.fetchone()[0] or 0
+
+            cursor.execute('SELECT SUM(access_count) FROM cached_prompts')
+            total_hits = cursor.fetchone()[0] or 0
+
+            cursor.execute('SELECT COUNT(*) FROM context_chunks')
+            chunk_count = cursor.fetchone()[0]
+
+            cursor.execute('SELECT SUM(reuse_count) FROM context_chunks')
+            total_chunk_reuses = cursor.fetchone()[0] or 0
         
         return {
             "cached_prompts": prompt_count,
@@ -241,19 +342,18 @@ class PromptCache:
         Args:
             older_than_days: Only clear entries older than N days
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        if older_than_days:
-            date_threshold = datetime.now() - timedelta(days=older_than_days)
-            cursor.execute('''
-                DELETE FROM cached_prompts 
-                WHERE created_at < ?
-            ''', (date_threshold,))
-        else:
-            cursor.execute('DELETE FROM cached_prompts')
-            cursor.execute('DELETE FROM context_chunks')
-        
-        conn.commit()
-        conn.close()
+        with self._lock:
+            cursor = self._conn.cursor()
+            if older_than_days:
+                date_threshold = datetime.now() - timedelta(days=older_than_days)
+                cursor.execute('''
+                    DELETE FROM cached_prompts 
+                    WHERE created_at < ?
+                ''', (date_threshold,))
+            else:
+                cursor.execute('DELETE FROM cached_prompts')
+                cursor.execute('DELETE FROM context_chunks')
+
+            self._mem.clear()
+            self._conn.commit()
         print("[OK] Cache cleared")
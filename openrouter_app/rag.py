@@ -1,6 +1,40 @@
 from .chat import invoke_model_stream, invoke_model_with_fallback, chat_with_openrouter
 from .system_prompt import get_system_prompt
 
+
+def build_messages(user_question, retrieved_text, message_history=None, include_question=True):
+    """Build an OpenAI-format message list with a prefix-stable layout.
+
+    Static parts (system prompt, then retrieved context as a system message)
+    come first so provider-side prompt caches can reuse the shared prefix
+    across turns; the growing history and the new question follow.
+
+    Args:
+        user_question: The question to answer
+        retrieved_text: Context retrieved from knowledge base (may be empty)
+        message_history: Optional list of prior messages
+        include_question: If False, leave the question off so the caller can
+            pass it separately (e.g. as chat_with_openrouter's user_message)
+
+    Returns:
+        List of message dicts ready to send to OpenRouter
+    """
+    messages = [{"role": "system", "content": get_system_prompt()}]
+
+    if retrieved_text:
+        messages.append({
+            "role": "system",
+            "content": f"Use the following context to answer the user's questions.\n\nContext:\n{retrieved_text}"
+        })
+
+    if message_history:
+        messages.extend(message_history)
+
+    if include_question:
+        messages.append({"role": "user", "content": user_question})
+    return messages
+
+
 def answer_with_context(model_id, user_question, retrieved_text, message_history=None, temperature=0.7, top_p=0.9):
     """Uses OpenRouter model to answer a question using retrieved context
 
@@ -18,26 +52,14 @@ def answer_with_context(model_id, user_question, retrieved_text, message_history
     if message_history is None:
         message_history = []
 
-    # Build the OpenAI-format messages
-    messages = message_history.copy() if message_history else []
-    messages.append({
-        "role": "user",
-        "content": f"Use the following context to answer the question.\n\nContext:\n{retrieved_text}\n\nQuestion:\n{user_question}"
-    })
-
-    # Prepend system prompt if not already present
-    if messages and messages[0].get("role") != "system":
-        system_prompt = get_system_prompt()
-        messages.insert(0, {
-            "role": "system",
-            "content": system_prompt
-        })
+    # Static prefix (system prompt, context) first, growing history after;
+    # the finished list goes straight through, no copy
+    messages = build_messages(user_question, retrieved_text, message_history)
 
     try:
         response = chat_with_openrouter(
             model_id,
-            "",  # Message is already in history
-            message_history=messages[:-1],  # Pass all but the last message as history
+            messages=messages,
             temperature=temperature,
             top_p=top_p
         )
@@ -52,7 +74,7 @@ def answer_with_context(model_id, user_question, retrieved_text, message_history
         return None
 
 
-def answer_with_context_stream(model_id, user_question, retrieved_text, message_history=None, temperature=0.7, top_p=0.9, character_stream=True):
+def answer_with_context_stream(model_id, user_question, retrieved_text, message_history=None, temperature=0.7, top_p=0.9):
     """Stream a response from OpenRouter using the provided retrieved context.
 
     Args:
@@ -62,31 +84,18 @@ def answer_with_context_stream(model_id, user_question, retrieved_text, message_
         message_history: Optional list of prior messages
         temperature: Sampling temperature
         top_p: Nucleus sampling parameter
-        character_stream: If True, stream character by character for smoother UI
 
     Yields:
-        Small text chunks suitable for real-time UI updates
+        Text deltas suitable for real-time UI updates
     """
     if message_history is None:
         message_history = []
 
-    # Build the OpenAI-format messages
-    messages = message_history.copy() if message_history else []
-    messages.append({
-        "role": "user",
-        "content": f"Use the following context to answer the question.\n\nContext:\n{retrieved_text}\n\nQuestion:\n{user_question}"
-    })
-
-    # Prepend system prompt if not already present
-    if messages and messages[0].get("role") != "system":
-        system_prompt = get_system_prompt()
-        messages.insert(0, {
-            "role": "system",
-            "content": system_prompt
-        })
+    # Static prefix (system prompt, context) first, growing history after
+    messages = build_messages(user_question, retrieved_text, message_history)
 
     try:
-        for chunk in invoke_model_with_fallback(model_id, messages, temperature, top_p, character_stream):
+        for chunk in invoke_model_with_fallback(model_id, messages, temperature, top_p):
             yield chunk
     except Exception as e:
         print(f"Error streaming answer_with_context: {e}")
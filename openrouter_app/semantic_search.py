@@ -1,10 +1,13 @@
 import os
-from pdfminer.high_level import extract_text as extract_pdf_text
-from docx import Document
-from .embedding import embed_with_openrouter, cosine_similarity
-from .image_handler import is_image_file, extract_text_with_fallback
+import numpy as np
+from .embedding import embed_with_openrouter, embed_query
 
 def load_documents_from_folder(folder_path):
+    # Parser imports live in their branches: pdfminer alone costs ~400ms
+    # and image OCR pulls in easyocr/torch, none of which should tax a
+    # folder with no matching files (or app cold start)
+    from .image_handler import is_image_file, extract_text_with_fallback
+
     documents = []
     for filename in os.listdir(folder_path):
         full_path = os.path.join(folder_path, filename)
@@ -18,12 +21,14 @@ def load_documents_from_folder(folder_path):
                 continue
         elif filename.endswith(".pdf"):
             try:
+                from pdfminer.high_level import extract_text as extract_pdf_text
                 content = extract_pdf_text(full_path)
             except Exception as e:
                 print(f"[ERROR] Failed to read PDF: {filename}  {e}")
                 continue
         elif filename.endswith(".docx"):
             try:
+                from docx import Document
                 doc = Document(full_path)
                 content = "\n".join([para.text for para in doc.paragraphs])
             except Exception as e:
@@ -50,28 +55,65 @@ def load_documents_from_folder(folder_path):
 
 def build_vector_store_from_folder(folder_path, embed_model_id):
     docs = load_documents_from_folder(folder_path)
-    store = []
+    entries = []
+    vectors = []
     for doc in docs:
         embedding = embed_with_openrouter(embed_model_id, doc["content"])
         if embedding:
-            store.append({
+            entries.append({
                 "filename": doc["filename"],
-                "content": doc["content"],
-                "embedding": embedding
+                "content": doc["content"]
             })
+            vectors.append(embedding)
             print(f"[OK] Embedded: {doc['filename']}")
         else:
             print(f"[ERROR] Failed to embed: {doc['filename']}")
-    return store
+
+    if not vectors:
+        return {"entries": [], "matrix": None}
+
+    # Row-normalized float32 matrix so cosine similarity is a single matmul
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+
+    # Scalar-quantize to int8 with a per-row scale: 4x less memory held in
+    # session state and 4x less bandwidth scanned per query
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(matrix / scales[:, None]).astype(np.int8)
+
+    return {"entries": entries, "matrix": quantized, "scales": scales}
 
 def semantic_search_local(query_text, embed_model_id, store, top_k=3):
-    query_embedding = embed_with_openrouter(embed_model_id, query_text)
+    query_embedding = embed_query(embed_model_id, query_text)
     if not query_embedding:
         print("Failed to generate embedding for query.")
         return []
-    scored = []
-    for entry in store:
-        score = cosine_similarity(query_embedding, entry["embedding"])
-        scored.append((entry["filename"], score, entry["content"]))
-    scored.sort(key=lambda x: x[1], reverse=True)
-    return scored[:top_k]
+
+    entries = store["entries"]
+    matrix = store["matrix"]
+    if matrix is None or not entries:
+        return []
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query_norm = np.linalg.norm(query)
+    if query_norm == 0:
+        return []
+    query /= query_norm
+
+    # Quantize the query the same way as the stored rows and score with an
+    # integer dot product, rescaling back to cosine similarity
+    query_scale = np.abs(query).max() / 127.0
+    if query_scale == 0:
+        return []
+    query_q = np.round(query / query_scale).astype(np.int8)
+
+    scores = (matrix.astype(np.int32) @ query_q.astype(np.int32)) * (store["scales"] * query_scale)
+
+    top_k = min(top_k, len(entries))
+    top_idx = np.argpartition(scores, -top_k)[-top_k:]
+    top_idx = top_idx[np.argsort(scores[top_idx])[::-1]]
+
+    return [(entries[i]["filename"], float(scores[i]), entries[i]["content"]) for i in top_idx]
@@ -3,24 +3,36 @@ System prompt loader for NESD-QA assistant.
 Loads and manages the domain-specific instruction set.
 """
 
+import functools
 import os
 from pathlib import Path
 
 
+@functools.lru_cache(maxsize=4)
+def _read_prompt(path: str, mtime_ns: int) -> str:
+    """Read the prompt file; keyed on mtime so edits invalidate the cache"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
 def load_system_prompt():
     """
     Load the NESD-QA system prompt from file.
     Returns the full system prompt as a string.
+
+    The file is read once per modification; every model invocation loads
+    the prompt, so repeat calls are answered from the in-process cache.
     """
     prompt_path = Path(__file__).parent.parent / "SYSTEM_PROMPT_NESD_QA.txt"
-    
-    if not prompt_path.exists():
+
+    try:
+        mtime_ns = prompt_path.stat().st_mtime_ns
+    except OSError:
         # Fallback prompt if file not found
         return get_default_system_prompt()
-    
+
     try:
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        return _read_prompt(str(prompt_path), mtime_ns)
     except Exception as e:
         print(f"Error loading system prompt: {e}")
         return get_default_system_prompt()
@@ -6,22 +6,94 @@ import json
 import os
 import pickle
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
 import numpy as np
-from .embedding import embed_with_openrouter, cosine_similarity
+from .embedding import embed_batch_with_openrouter, embed_query, EMBED_BATCH_SIZE
+
+# Optional ANN backend: falls back to the exact matmul scan when absent
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Below this row count the exact scan is faster than an ANN probe
+_ANN_MIN_ROWS = 2000
 
 class VectorStoreManager:
     """Manages pre-vectorized knowledge base with persistent caching"""
     
-    def __init__(self, cache_dir: str = "./.vector_cache"):
+    def __init__(self, cache_dir: str = "./.vector_cache", dtype: str = "float32"):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         self.metadata_file = self.cache_dir / "metadata.json"
-        self.vectors_file = self.cache_dir / "vectors.pkl"
+        self.vectors_file = self.cache_dir / "vectors.pkl"  # legacy format
+        self.matrix_file = self.cache_dir / "matrix.npy"
+        self.entries_file = self.cache_dir / "entries.jsonl"
+        self.contents_file = self.cache_dir / "contents.bin"
+        self.offsets_file = self.cache_dir / "offsets.npy"
+        self.scales_file = self.cache_dir / "scales.npy"
+        self.ann_file = self.cache_dir / "ann.bin"
+        # Structure-of-arrays: entry dicts hold the text/metadata, the
+        # row-normalized matrix holds all embeddings contiguously. Scoring
+        # is memory-bound, so dtype trades bandwidth against precision:
+        # "float32" is exact, "float16" halves bytes (NumPy upcasts in the
+        # matmul), "int8" quarters them via symmetric per-row quantization
+        # (same scheme as the session store in semantic_search).
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        self.dtype = dtype
         self.store = []
+        self._matrix = None
+        self._scales = None
+        self._ann = None
+        self._offsets = None
         self.metadata = self._load_metadata()
+
+    def _content(self, index: int) -> str:
+        """Chunk text for a store entry, read from disk when loaded lazily"""
+        entry = self.store[index]
+        content = entry.get("content")
+        if content is None:
+            start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+            with open(self.contents_file, 'rb') as f:
+                f.seek(start)
+                content = f.read(end - start).decode('utf-8')
+        return content
+
+    def _build_ann_index(self, save: bool = True):
+        """Build an HNSW index over the float32 matrix when it pays off"""
+        self._ann = None
+        if (hnswlib is None or self._matrix is None or self._scales is not None
+                or len(self.store) < _ANN_MIN_ROWS):
+            if save and self.ann_file.exists():
+                # Same hygiene as scales.npy: no stale index on disk when
+                # the rebuilt store no longer carries one
+                self.ann_file.unlink()
+            return
+        num, dim = self._matrix.shape
+        index = hnswlib.Index(space='cosine', dim=dim)
+        index.init_index(max_elements=num, ef_construction=200, M=16)
+        index.add_items(np.asarray(self._matrix), np.arange(num))
+        self._ann = index
+        if save:
+            index.save_index(str(self.ann_file))
+
+    @staticmethod
+    def _quantize_rows(matrix):
+        """Symmetric per-row int8 quantization; returns (int8 matrix, scales)"""
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales
+
+    @staticmethod
+    def _normalize_rows(matrix):
+        """Row-normalize so cosine similarity is a plain dot product"""
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
         
     def _load_metadata(self) -> Dict:
         """Load metadata about cached vectors"""
@@ -45,30 +117,72 @@ class VectorStoreManager:
     def _get_file_hash(self, file_path: str) -> str:
         """Calculate hash of file content"""
         try:
+            # Incremental hashing over 1 MiB blocks keeps peak memory flat
+            # instead of materializing whole PDFs as one bytes object
+            hasher = hashlib.blake2b(digest_size=16)
             with open(file_path, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    hasher.update(block)
+            return hasher.hexdigest()
         except Exception as e:
             print(f"Error calculating file hash: {e}")
             return ""
-    
-    def _is_cache_valid(self, folder_path: str, embed_model_id: str) -> bool:
-        """Check if cached vectors are still valid"""
-        if not self.vectors_file.exists():
-            return False
-        
-        if self.metadata.get("model_id") != embed_model_id:
-            return False
-        
-        # Check if any files have changed
-        current_files = {}
-        for filename in os.listdir(folder_path):
-            if filename.endswith(('.txt', '.pdf', '.docx', '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tiff', '.tif')):
-                file_path = os.path.join(folder_path, filename)
-                current_files[filename] = self._get_file_hash(file_path)
-        
-        # Compare with cached metadata
+
+    def _file_entry(self, file_path: str) -> Dict:
+        """Hash plus stat signature recorded per file in the metadata"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return {"hash": "", "size": 0, "mtime_ns": 0}
+        return {
+            "hash": self._get_file_hash(file_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    def _check_cache(self, folder_path: str, embed_model_id: str) -> Tuple[bool, Dict]:
+        """Validate the cache and return (valid, fresh per-file entries).
+
+        A matching (size, mtime_ns) stat signature skips re-reading the
+        file; only files whose metadata moved get re-hashed (same fast path
+        git uses). The returned entries are handed to build_from_folder so
+        a rebuild never re-hashes files this check already settled.
+        """
+        valid = (self.entries_file.exists() or self.vectors_file.exists()) \
+            and self.metadata.get("model_id") == embed_model_id
+
         cached_files = self.metadata.get("files", {})
-        return current_files == cached_files
+        current = {}
+        for filename in os.listdir(folder_path):
+            if not filename.endswith(('.txt', '.pdf', '.docx', '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp', '.tiff', '.tif')):
+                continue
+            cached = cached_files.get(filename)
+            file_path = os.path.join(folder_path, filename)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                valid = False
+                current[filename] = {"hash": "", "size": 0, "mtime_ns": 0}
+                continue
+            if isinstance(cached, dict) and \
+                    (stat.st_size, stat.st_mtime_ns) == (cached.get("size"), cached.get("mtime_ns")):
+                current[filename] = cached
+                continue
+            entry = {
+                "hash": self._get_file_hash(file_path),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+            current[filename] = entry
+            # Missing, legacy hash-only, or changed-content entries all
+            # force a rebuild
+            if not isinstance(cached, dict) or entry["hash"] != cached.get("hash"):
+                valid = False
+
+        # No files added or removed
+        if set(current) != set(cached_files):
+            valid = False
+        return valid, current
     
     def build_from_folder(self, folder_path: str, embed_model_id: str, documents: List[Dict] = None) -> List[Dict]:
         """
@@ -80,8 +194,9 @@ class VectorStoreManager:
         Returns:
             List of document entries with embeddings
         """
-        # Check if cache is valid
-        if self._is_cache_valid(folder_path, embed_model_id):
+        # Check if cache is valid; keep the per-file hashes it computed
+        valid, file_entries = self._check_cache(folder_path, embed_model_id)
+        if valid:
             print("[OK] Loading from cache...")
             return self._load_from_cache()
         
@@ -92,66 +207,143 @@ class VectorStoreManager:
             documents = load_documents_from_folder(folder_path)
         
         store = []
+        vectors = []
         file_hashes = {}
         
         # Chunk documents into smaller passages to improve retrieval granularity
         chunk_size = 1000  # characters per chunk (approximate)
         chunk_overlap = 200  # overlap between chunks
 
+        # First pass: collect every chunk so the network-bound embedding
+        # calls can be issued concurrently
+        pending = []  # (source filename, chunk_name, chunk_text)
         for doc in documents:
             text = doc.get("content", "")
             filename = doc.get("filename", "unknown")
 
-            # Compute and store file hash for original file
+            # Reuse the hash + stat signature from the validity check
             file_path = os.path.join(folder_path, filename)
-            file_hashes[filename] = self._get_file_hash(file_path)
+            file_hashes[filename] = file_entries.get(filename) or self._file_entry(file_path)
 
             if not text:
                 print(f"[ERROR] Empty content: {filename}")
                 continue
 
-            # Create overlapping chunks
-            start = 0
-            chunk_index = 0
+            # Precompute overlapping chunk boundaries, then materialize each
+            # slice exactly once when it is queued for embedding
             text_len = len(text)
-            while start < text_len:
+            step = chunk_size - chunk_overlap
+            boundaries = []
+            for start in range(0, text_len, step):
                 end = min(start + chunk_size, text_len)
-                chunk_text = text[start:end]
-                chunk_name = f"{filename}__chunk_{chunk_index}"
-
-                embedding = embed_with_openrouter(embed_model_id, chunk_text)
-                if embedding:
-                    store.append({
-                        "filename": chunk_name,
-                        "source": filename,
-                        "content": chunk_text,
-                        "embedding": embedding,
-                        "timestamp": datetime.now().isoformat()
-                    })
-                    print(f"[OK] Embedded chunk: {chunk_name}")
-                else:
-                    print(f"[ERROR] Failed to embed chunk: {chunk_name}")
-
-                chunk_index += 1
-                # Advance with overlap
-                start = end - chunk_overlap if end < text_len else end
+                boundaries.append((start, end))
+                if end == text_len:
+                    break
+            for chunk_index, (start, end) in enumerate(boundaries):
+                pending.append((filename, f"{filename}__chunk_{chunk_index}", text[start:end]))
+
+        # Identical chunk texts (repeated boilerplate headers/footers across
+        # documents) only cost one embedding call each
+        unique_texts = list(dict.fromkeys(item[2] for item in pending))
+        deduped = len(pending) - len(unique_texts)
+        if deduped:
+            print(f"[DEDUP] {deduped}/{len(pending)} chunks share an already-embedded text")
+
+        # Batched requests amortize HTTP overhead and let the provider run
+        # one forward pass per batch; the thread pool overlaps batches so
+        # total wall time is roughly ceil(num_batches / workers) latencies.
+        # map preserves order, so the flattened vectors line up with texts
+        batches = [unique_texts[i:i + EMBED_BATCH_SIZE]
+                   for i in range(0, len(unique_texts), EMBED_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            batch_vectors = executor.map(
+                lambda batch: embed_batch_with_openrouter(embed_model_id, batch), batches
+            )
+            embeddings = dict(zip(unique_texts,
+                                  (vec for vectors in batch_vectors for vec in vectors)))
+
+        for filename, chunk_name, chunk_text in pending:
+            embedding = embeddings[chunk_text]
+            if embedding:
+                store.append({
+                    "filename": chunk_name,
+                    "source": filename,
+                    "content": chunk_text,
+                    "timestamp": datetime.now().isoformat()
+                })
+                vectors.append(embedding)
+                print(f"[OK] Embedded chunk: {chunk_name}")
+            else:
+                print(f"[ERROR] Failed to embed chunk: {chunk_name}")
         
         # Update metadata
         self.metadata["files"] = file_hashes
         self.metadata["model_id"] = embed_model_id
         self._save_metadata()
         
+        if vectors:
+            self._matrix = self._normalize_rows(np.asarray(vectors, dtype=np.float32))
+            if self.dtype == "int8":
+                self._matrix, self._scales = self._quantize_rows(self._matrix)
+            elif self.dtype == "float16":
+                self._matrix = self._matrix.astype(np.float16)
+        else:
+            self._matrix = None
+            self._scales = None
+
         # Save to cache
         self._save_to_cache(store)
         self.store = store
+        self._build_ann_index()
         
         return store
     
+    @staticmethod
+    def _save_array(path, array):
+        """Write an array to path atomically (tmp file + rename)"""
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+
     def _save_to_cache(self, store: List[Dict]):
-        """Persist vector store to disk"""
+        """Persist vector store to disk
+
+        Entry metadata goes to a small JSONL file; chunk texts are packed
+        into one binary blob with an offsets array so loads can skip them,
+        and the matrix is a plain .npy that mmaps on load. No pickle graph
+        traversal on either side. Every file is written to a temp name and
+        renamed into place so a crash mid-save cannot leave the sidecars
+        disagreeing with each other.
+        """
         try:
-            with open(self.vectors_file, 'wb') as f:
-                pickle.dump(store, f)
+            entries_tmp = self.entries_file.with_suffix('.jsonl.tmp')
+            contents_tmp = self.contents_file.with_suffix('.bin.tmp')
+            offsets = [0]
+            with open(entries_tmp, 'w', encoding='utf-8') as meta_f, \
+                    open(contents_tmp, 'wb') as content_f:
+                for entry in store:
+                    meta_f.write(json.dumps({
+                        "filename": entry["filename"],
+                        "source": entry["source"],
+                        "timestamp": entry["timestamp"],
+                    }, separators=(",", ":")) + "\n")
+                    content_f.write(entry["content"].encode('utf-8'))
+                    offsets.append(content_f.tell())
+            self._save_array(self.offsets_file, np.asarray(offsets, dtype=np.int64))
+            if self._matrix is not None:
+                self._save_array(self.matrix_file, self._matrix)
+            if self._scales is not None:
+                self._save_array(self.scales_file, self._scales)
+            elif self.scales_file.exists():
+                # A rebuild under a different dtype must not leave the old
+                # quantization sidecar to be paired with the new matrix
+                self.scales_file.unlink()
+            os.replace(contents_tmp, self.contents_file)
+            # Renamed last: its presence marks the cache as complete
+            os.replace(entries_tmp, self.entries_file)
+            if self.vectors_file.exists():
+                self.vectors_file.unlink()
             print(f"[SAVED] Cached {len(store)} embeddings")
         except Exception as e:
             print(f"Error saving cache: {e}")
@@ -159,8 +351,25 @@ class VectorStoreManager:
     def _load_from_cache(self) -> List[Dict]:
         """Load vector store from disk"""
         try:
-            with open(self.vectors_file, 'rb') as f:
-                self.store = pickle.load(f)
+            if self.entries_file.exists():
+                with open(self.entries_file, 'r', encoding='utf-8') as f:
+                    self.store = [json.loads(line) for line in f]
+                self._offsets = np.load(self.offsets_file)
+                self._matrix = np.load(self.matrix_file, mmap_mode='r') \
+                    if self.matrix_file.exists() else None
+                self._scales = np.load(self.scales_file) if self.scales_file.exists() else None
+                if hnswlib is not None and self.ann_file.exists() and self._scales is None:
+                    self._ann = hnswlib.Index(space='cosine', dim=self._matrix.shape[1])
+                    self._ann.load_index(str(self.ann_file))
+            else:
+                # Legacy pickle cache: load once and rewrite in the new
+                # layout (embeddings may still live inside the entry dicts)
+                with open(self.vectors_file, 'rb') as f:
+                    self.store = pickle.load(f)
+                vectors = [e.pop("embedding") for e in self.store if "embedding" in e]
+                if vectors:
+                    self._matrix = self._normalize_rows(np.asarray(vectors, dtype=np.float32))
+                self._save_to_cache(self.store)
             print(f"[LOADED] Loaded {len(self.store)} embeddings from cache")
             return self.store
         except Exception as e:
@@ -177,18 +386,46 @@ class VectorStoreManager:
         Returns:
             List of tuples (filename, score, content)
         """
-        query_embedding = embed_with_openrouter(embed_model_id, query_text)
+        query_embedding = embed_query(embed_model_id, query_text)
         if not query_embedding:
             print("Failed to generate embedding for query.")
             return []
-        
-        scored = []
-        for entry in self.store:
-            score = cosine_similarity(query_embedding, entry["embedding"])
-            scored.append((entry["filename"], score, entry["content"]))
-        
-        scored.sort(key=lambda x: x[1], reverse=True)
-        return scored[:top_k]
+
+        if self._matrix is None or not self.store:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return []
+        query /= query_norm
+
+        if self._ann is not None:
+            # Sublinear ANN probe; hnswlib returns cosine distances
+            top_k = min(top_k, len(self.store))
+            labels, distances = self._ann.knn_query(query, k=top_k)
+            return [(self.store[i]["filename"], float(1.0 - d), self._content(i))
+                    for i, d in zip(labels[0], distances[0])]
+
+        # Rows are pre-normalized, so one matrix-vector product yields all
+        # cosine scores; argpartition avoids a full sort for the top-k
+        if self._scales is not None:
+            # Quantized store: integer dot products rescaled back to cosine
+            query_scale = np.abs(query).max() / 127.0
+            if query_scale == 0:
+                return []
+            query_q = np.round(query / query_scale).astype(np.int8)
+            scores = (self._matrix.astype(np.int32) @ query_q.astype(np.int32)) \
+                * (self._scales * query_scale)
+        else:
+            scores = self._matrix @ query
+
+        top_k = min(top_k, len(self.store))
+        top_idx = np.argpartition(scores, -top_k)[-top_k:]
+        top_idx = top_idx[np.argsort(scores[top_idx])[::-1]]
+
+        return [(self.store[i]["filename"], float(scores[i]), self._content(i))
+                for i in top_idx]
     
     def clear_cache(self):
         """Clear all cached vectors"""
@@ -197,7 +434,20 @@ class VectorStoreManager:
                 self.vectors_file.unlink()
             if self.metadata_file.exists():
                 self.metadata_file.unlink()
+            if self.matrix_file.exists():
+                self.matrix_file.unlink()
+            if self.scales_file.exists():
+                self.scales_file.unlink()
+            if self.ann_file.exists():
+                self.ann_file.unlink()
+            for path in (self.entries_file, self.contents_file, self.offsets_file):
+                if path.exists():
+                    path.unlink()
             self.store = []
+            self._matrix = None
+            self._scales = None
+            self._ann = None
+            self._offsets = None
             self.metadata = {"files": {}, "last_updated": None, "model_id": None}
             print("[OK] Cache cleared")
         except Exception as e:
@@ -209,5 +459,5 @@ class VectorStoreManager:
             "num_vectors": len(self.store),
             "cache_dir": str(self.cache_dir),
             "metadata": self.metadata,
-            "cache_exists": self.vectors_file.exists()
+            "cache_exists": self.entries_file.exists() or self.vectors_file.exists()
         }